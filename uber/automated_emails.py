@@ -5,16 +5,54 @@
 from uber.common import *
 
 
+def eager_load_plan(model, paths):
+    """
+    Accepts a model and a collection of dotted relationship paths such as
+    "shifts.job" and returns a list of loader options which load all of them
+    up front: one-to-one and many-to-one relationships are joined into the main
+    query and collections each get one extra query, so loading everything takes
+    a fixed number of queries no matter how many rows there are.
+    """
+    paths = {path for path in paths if not any(other.startswith(path + '.') for other in paths)}
+    options = []
+    for path in sorted(paths):
+        loader, current = None, model
+        for name in path.split('.'):
+            prop = sqlalchemy.inspect(current).relationships[name]
+            attr, eager = getattr(current, name), 'subqueryload' if prop.uselist else 'joinedload'
+            loader = getattr(loader, eager)(attr) if loader else globals()[eager](attr)
+            current = prop.mapper.class_
+        options.append(loader)
+    return options
+
+
 class AutomatedEmail:
     instances = OrderedDict()
 
-    def __init__(self, model, subject, template, filter, *, sender=None, extra_data=None, cc=None, bcc=None, post_con=False, needs_approval=False):
-        self.model, self.template, self.needs_approval = model, template, needs_approval
+    # Relationships which our filters need for each model, as dotted paths like "shifts.job".  Subclasses can add to
+    # this with their own "needs" attribute and individual emails with the "needs" argument; all of these are merged
+    # into one eager-load plan per model by eager_loads() so that we don't lazy-load anything one row at a time.
+    base_needs = {Attendee: ['group'], Group: ['attendees', 'leader']}
+    needs = ()
+
+    # SQL conditions which everything passing an email's filter must also meet, so that when we only care about one
+    # email we can narrow down its candidates in the database; merged from the class attribute and the "criteria"
+    # argument the same way as "needs".
+    criteria = ()
+
+    # Set by "sep run_worker"; we only ever fork email worker processes from there, never from the threaded web server,
+    # which also runs send_all whenever c.RUN_DAEMON_TASKS is on.
+    in_worker = False
+
+    def __init__(self, model, subject, template, filter, *, sender=None, extra_data=None, cc=None, bcc=None, post_con=False, needs_approval=False, needs=(), criteria=(), coalescible=False):
+        self.model, self.template, self.needs_approval, self.coalescible = model, template, needs_approval, coalescible
         self.subject = subject.format(EVENT_NAME=c.EVENT_NAME)
         self.cc = cc or []
         self.bcc = bcc or []
         self.extra_data = extra_data or {}
         self.sender = sender or c.REGDESK_EMAIL
+        self.needs = set(self.needs).union(needs)
+        self.criteria = list(self.criteria) + list(criteria)
         self.instances[self.subject] = self
         if post_con:
             self.filter = lambda x: c.POST_CON and filter(x)
@@ -25,8 +63,8 @@ class AutomatedEmail:
         return '<{}: {!r}>'.format(self.__class__.__name__, self.subject)
 
     def prev(self, x, all_sent=None):
-        if all_sent:
-            return all_sent.get((x.__class__.__name__, x.id, self.subject))
+        if all_sent is not None:
+            return (x.__class__.__name__, x.id, self.subject) in all_sent
         else:
             with Session() as session:
                 return session.query(Email).filter_by(model=x.__class__.__name__, fk_id=x.id, subject=self.subject).all()
@@ -41,37 +79,227 @@ class AutomatedEmail:
         model = 'attendee' if isinstance(x, PrevSeasonSupporter) else x.__class__.__name__.lower()
         return render('emails/' + self.template, dict({model: x}, **self.extra_data))
 
-    def send(self, x, raise_errors=True):
+    def send(self, x, raise_errors=True, body=None):
         try:
             format = 'text' if self.template.endswith('.txt') else 'html'
-            send_email(self.sender, x.email, self.subject, self.render(x), format, model=x, cc=self.cc)
+            send_email(self.sender, x.email, self.subject, body or self.render(x), format, model=x, cc=self.cc)
         except:
             log.error('error sending {!r} email to {}', self.subject, x.email, exc_info=True)
             if raise_errors:
                 raise
 
-    # TODO: joinedload on other tables such as shifts as well, for performance (this method is WAY slower than it could be)
+    def candidates(self, session):
+        """Returns a query for everything which might pass our filter, narrowed down in SQL by our criteria."""
+        return session.query(self.model).filter(*self.criteria)
+
+    def stream(self, session, chunk_size=100):
+        """
+        Yields our candidates a chunk at a time, with each chunk loaded using our
+        own eager-load plan, so that callers which only need a few matches can
+        stop early without loading everything.
+        """
+        ids = [id for [id] in self.candidates(session).with_entities(self.model.id).order_by(self.model.id)]
+        options = eager_load_plan(self.model, self.needs.union(self.base_needs.get(self.model, [])))
+        for i in range(0, len(ids), chunk_size):
+            query = session.query(self.model).filter(self.model.id.in_(ids[i:i + chunk_size])).options(*options)
+            yield from query.order_by(self.model.id)
+
+    @classmethod
+    def eager_loads(cls, model):
+        paths = set(cls.base_needs.get(model, []))
+        for rem in cls.instances.values():
+            if rem.model is model:
+                paths.update(rem.needs)
+        return eager_load_plan(model, paths)
+
+    @classmethod
+    def load_models(cls, session):
+        """Returns everything our emails might be sent to, keyed by the "model" of each email."""
+        return {
+            Attendee: session.query(Attendee).options(*cls.eager_loads(Attendee)).all(),
+            Group: session.query(Group).options(*cls.eager_loads(Group)).all(),
+            'SeasonPass': session.season_passes()
+        }
+
+    @classmethod
+    def evaluate(cls, model, subjects, ids=None, skip_sent=True, render_limit=None, parallel=False):
+        """
+        Returns a dict mapping each subject to a (count, examples) tuple, where
+        count is the number of objects of the given model (optionally limited
+        to the given ids) which pass the filter for that email, and examples is
+        a list of (id, rendered body) tuples for up to render_limit of them.  If
+        skip_sent is True then we use should_send() rather than just the filter.
+
+        If parallel is True and the email_workers option is set, this splits the
+        work into partitions and runs them across a pool of processes, each with
+        its own database connections and compiled templates.  Forking a pool from
+        inside the web server can deadlock on locks held by other threads, so
+        only send_all passes parallel=True, and we only fork when running under
+        "sep run_worker"; everywhere else we work in-process.
+
+        When evaluating a single email, we only look at rows matching its criteria.
+        """
+        criteria = cls.instances[subjects[0]].criteria if len(subjects) == 1 else []
+        if parallel and ids is None and c.EMAIL_WORKERS > 1 and not cls.in_worker:
+            log.warning('email_workers is only used by "sep run_worker", so we are evaluating {} emails in-process', model.__name__)
+        elif parallel and ids is None and c.EMAIL_WORKERS > 1:
+            with Session() as session:
+                ids = [id for [id] in session.query(model.id).filter(*criteria).order_by(model.id)]
+            size = max(100, math.ceil(len(ids) / (4 * c.EMAIL_WORKERS)))
+            partitions = [(model.__name__, subjects, ids[i:i + size], skip_sent, render_limit) for i in range(0, len(ids), size)]
+            results = defaultdict(lambda: (0, []))
+            with closing(multiprocessing.Pool(c.EMAIL_WORKERS, initializer=_init_email_worker)) as pool:
+                for partition in pool.imap(_evaluate_partition, partitions):
+                    for subject, (count, examples) in partition.items():
+                        total, merged = results[subject]
+                        results[subject] = (total + count, (merged + examples)[:render_limit])
+                pool.close()
+                pool.join()
+            return {subject: results[subject] for subject in subjects}
+
+        with Session() as session:
+            query = session.query(model).filter(*criteria).options(*cls.eager_loads(model))
+            xs = query.filter(model.id.in_(ids)).all() if ids is not None else query.all()
+            sent = None
+            if skip_sent:
+                sent = session.query(Email.model, Email.fk_id, Email.subject).filter(Email.model == model.__name__, Email.subject.in_(subjects))
+                sent = set(sent.filter(Email.fk_id.in_(ids)) if ids is not None else sent)
+            results = {}
+            for subject in subjects:
+                rem, count, examples = cls.instances[subject], 0, []
+                for x in xs:
+                    if rem.should_send(x, sent) if skip_sent else rem.filter(x):
+                        count += 1
+                        if render_limit is None or len(examples) < render_limit:
+                            examples.append((x.id, rem.render(x)))
+                results[subject] = (count, examples)
+            return results
+
     @classmethod
     def send_all(cls, raise_errors=False):
         if not c.AT_THE_CON and (c.DEV_BOX or c.SEND_EMAILS):
             with Session() as session:
-                attendees, groups = session.everyone()
                 approved = {ae.subject for ae in session.query(ApprovedEmail).all()}
-                models = {Attendee: attendees, Group: groups, 'SeasonPass': session.season_passes()}
-                all_sent = {(e.model, e.fk_id, e.subject): e for e in session.query(Email).all()}
-                for rem in cls.instances.values():
-                    if not rem.needs_approval or rem.subject in approved:
-                        for x in models[rem.model]:
-                            if rem.should_send(x, all_sent):
-                                rem.send(x, raise_errors=raise_errors)
+                active = [rem for rem in cls.instances.values() if not rem.needs_approval or rem.subject in approved]
+                outbox = Outbox(raise_errors=raise_errors)
+                if c.EMAIL_WORKERS > 1:
+                    for model in [Attendee, Group]:
+                        subjects = [rem.subject for rem in active if rem.model is model]
+                        evaluated = cls.evaluate(model, subjects, parallel=True)
+                        ids = {id for count, rendered in evaluated.values() for id, body in rendered}
+                        recipients = {x.id: x for x in session.query(model).filter(model.id.in_(ids))
+                                                                         .options(*cls.eager_loads(model))} if ids else {}
+                        for subject, (count, rendered) in evaluated.items():
+                            for id, body in rendered:
+                                if id in recipients:  # skips anyone deleted since their email was rendered
+                                    outbox.add(cls.instances[subject], recipients[id], body)
+                    active = [rem for rem in active if rem.model not in [Attendee, Group]]
+                    models = {'SeasonPass': session.season_passes()}
+                else:
+                    models = cls.load_models(session)
+
+                all_sent = set(session.query(Email.model, Email.fk_id, Email.subject))
+                for rem in active:
+                    for x in models[rem.model]:
+                        if rem.should_send(x, all_sent):
+                            outbox.add(rem, x)
+                outbox.flush()
+
+
+class Outbox:
+    """
+    Collects the emails that send_all has decided to send.  Most are sent right
+    away, but if the email_digests option is on then emails marked coalescible
+    are held until the end of the run, and when several of them are going to the
+    same address from the same sender, we combine them into a single digest.  We
+    still record a separate Email row for each one so that we never resend them.
+    """
+
+    def __init__(self, raise_errors=False):
+        self.raise_errors = raise_errors
+        self.held = OrderedDict()
+
+    def add(self, rem, x, body=None):
+        if c.EMAIL_DIGESTS and rem.coalescible:
+            try:
+                body = body or rem.render(x)
+            except:
+                log.error('error rendering {!r} email to {}', rem.subject, x.email, exc_info=True)
+                if self.raise_errors:
+                    raise
+            else:
+                self.held.setdefault((rem.sender, x.email.lower()), []).append((rem, x, body))
+        else:
+            rem.send(x, raise_errors=self.raise_errors, body=body)
+
+    def flush(self):
+        for (sender, dest), queued in self.held.items():
+            if len(queued) == 1:
+                [(rem, x, body)] = queued
+                rem.send(x, raise_errors=self.raise_errors, body=body)
+            else:
+                self.send_digest(sender, queued)
+        self.held.clear()
+
+    def send_digest(self, sender, queued):
+        dest = queued[0][1].email
+        try:
+            parts = [_digest_part(rem, body) for rem, x, body in queued]
+            body = render('emails/digests/digest.html', {'parts': parts})
+            subject = '{} updates from {}'.format(len(queued), c.EVENT_NAME)
+            send_email(sender, dest, subject, body, format='html', cc=sorted({cc for rem, x, b in queued for cc in rem.cc}))
+            with Session() as session:
+                for rem, x, part in queued:
+                    session.add(Email(subject=rem.subject, dest=dest, body=part.decode('utf-8') if isinstance(part, bytes) else part,
+                                      model=x.__class__.__name__, fk_id=x.id))
+        except:
+            log.error('error sending digest of {} to {}', [rem.subject for rem, x, b in queued], dest, exc_info=True)
+            if self.raise_errors:
+                raise
+
+
+def _digest_part(rem, body):
+    """
+    Returns a (subject, body, is_text) tuple for the digest template, which
+    escapes plaintext emails and includes what's inside the <body> tag of HTML
+    emails as-is.
+    """
+    body = body.decode('utf-8') if isinstance(body, bytes) else body
+    if rem.template.endswith('.txt'):
+        return rem.subject, body, True
+    else:
+        return rem.subject, SafeString(body.split('<body>')[1].split('</body>')[0] if '<body>' in body else body), False
+
+
+def _init_email_worker():
+    """
+    Runs once in each of our email worker processes.  Connections inherited from
+    the parent process can't be safely shared, so we throw them away and let this
+    process open its own, and we compile our email templates once up front.
+    We hang onto the inherited pool rather than closing it, since closing those
+    connections here would also close them out from under the parent process.
+    """
+    global _inherited_pool
+    _inherited_pool, Session.engine.pool = Session.engine.pool, Session.engine.pool.recreate()
+    for rem in AutomatedEmail.instances.values():
+        loader.get_template('emails/' + rem.template)
+
+
+def _evaluate_partition(args):
+    model_name, subjects, ids, skip_sent, render_limit = args
+    return AutomatedEmail.evaluate(Session.resolve_model(model_name), subjects, ids, skip_sent, render_limit)
 
 
 class StopsEmail(AutomatedEmail):
+    criteria = [Attendee.staffing == True]
+
     def __init__(self, subject, template, filter, **kwargs):
         AutomatedEmail.__init__(self, Attendee, subject, template, lambda a: a.staffing and filter(a), sender=c.STAFF_EMAIL, **kwargs)
 
 
 class GuestEmail(AutomatedEmail):
+    criteria = [Attendee.badge_type == c.GUEST_BADGE]
+
     def __init__(self, subject, template, filter=lambda a: True, needs_approval=True, **kwargs):
         AutomatedEmail.__init__(self, Attendee, subject, template, lambda a: a.badge_type == c.GUEST_BADGE and filter(a), needs_approval=needs_approval, sender=c.PANELS_EMAIL, **kwargs)
 
@@ -82,6 +310,8 @@ class GroupEmail(AutomatedEmail):
 
 
 class MarketplaceEmail(AutomatedEmail):
+    criteria = [Group.tables > 0]
+
     def __init__(self, subject, template, filter, **kwargs):
         AutomatedEmail.__init__(self, Group, subject, template, lambda g: g.is_dealer and filter(g), sender=c.MARKETPLACE_EMAIL, **kwargs)
 
@@ -103,6 +333,8 @@ class DeptChecklistEmail(AutomatedEmail):
                                 template='shifts/dept_checklist.txt',
                                 filter=lambda a: a.is_single_dept_head and a.admin_account and days_before(7, conf.deadline) and not conf.completed(a),
                                 sender=c.STAFF_EMAIL,
+                                needs=['admin_account', 'dept_checklist_items'],
+                                criteria=[Attendee.ribbon == c.DEPT_HEAD_RIBBON],
                                 extra_data={'conf': conf})
 
 before = lambda dt: bool(dt) and localized_now() < dt
@@ -126,7 +358,7 @@ AutomatedEmail(Group, '{EVENT_NAME} group payment received', 'reg_workflow/group
          lambda g: g.amount_paid == g.cost and g.cost != 0)
 
 AutomatedEmail(Attendee, '{EVENT_NAME} group registration confirmed', 'reg_workflow/attendee_confirmation.html',
-         lambda a: a.group and a != a.group.leader and not a.placeholder)
+         lambda a: a.group and a != a.group.leader and not a.placeholder, needs=['group.leader'])
 
 AutomatedEmail(Attendee, '{EVENT_NAME} extra payment received', 'reg_workflow/group_donation.txt',
          lambda a: a.paid == c.PAID_BY_GROUP and a.amount_extra and a.amount_paid == a.amount_extra)
@@ -177,34 +409,42 @@ MarketplaceEmail('{EVENT_NAME} Dealer waitlist has been exhausted', 'dealers/wai
 
 AutomatedEmail(Attendee, '{EVENT_NAME} Panelist Badge Confirmation', 'placeholders/panelist.txt',
                lambda a: a.placeholder and a.first_name and a.last_name and a.ribbon == c.PANELIST_RIBBON,
-               sender=c.PANELS_EMAIL)
+               sender=c.PANELS_EMAIL,
+               criteria=[Attendee.placeholder == True])
 
 AutomatedEmail(Attendee, '{EVENT_NAME} Guest Badge Confirmation', 'placeholders/guest.txt',
                lambda a: a.placeholder and a.first_name and a.last_name and a.badge_type == c.GUEST_BADGE,
-               sender=c.PANELS_EMAIL)
+               sender=c.PANELS_EMAIL,
+               criteria=[Attendee.placeholder == True])
 
 AutomatedEmail(Attendee, '{EVENT_NAME} Dealer Information Required', 'placeholders/dealer.txt',
                lambda a: a.placeholder and a.is_dealer and a.group.status == c.APPROVED,
-               sender=c.MARKETPLACE_EMAIL)
+               sender=c.MARKETPLACE_EMAIL,
+               criteria=[Attendee.placeholder == True])
 
 StopsEmail('Want to staff {EVENT_NAME} again?', 'placeholders/imported_volunteer.txt',
-           lambda a: a.placeholder and a.staffing and a.registered_local <= c.PREREG_OPEN)
+           lambda a: a.placeholder and a.staffing and a.registered_local <= c.PREREG_OPEN,
+           criteria=[Attendee.placeholder == True])
 
 StopsEmail('{EVENT_NAME} Volunteer Badge Confirmation', 'placeholders/volunteer.txt',
            lambda a: a.placeholder and a.first_name and a.last_name
-                                      and a.registered_local > c.PREREG_OPEN)
+                                      and a.registered_local > c.PREREG_OPEN,
+           criteria=[Attendee.placeholder == True])
 
 AutomatedEmail(Attendee, '{EVENT_NAME} Badge Confirmation', 'placeholders/regular.txt',
                lambda a: a.placeholder and a.first_name and a.last_name
                                        and a.badge_type not in [c.GUEST_BADGE, c.STAFF_BADGE]
-                                       and a.ribbon not in [c.DEALER_RIBBON, c.PANELIST_RIBBON, c.VOLUNTEER_RIBBON])
+                                       and a.ribbon not in [c.DEALER_RIBBON, c.PANELIST_RIBBON, c.VOLUNTEER_RIBBON],
+               criteria=[Attendee.placeholder == True])
 
 AutomatedEmail(Attendee, '{EVENT_NAME} Badge Confirmation Reminder', 'placeholders/reminder.txt',
-               lambda a: days_after(7, a.registered) and a.placeholder and a.first_name and a.last_name and not a.is_dealer)
+               lambda a: days_after(7, a.registered) and a.placeholder and a.first_name and a.last_name and not a.is_dealer,
+               criteria=[Attendee.placeholder == True], coalescible=True)
 
 AutomatedEmail(Attendee, 'Last Chance to Accept Your {EVENT_NAME} Badge', 'placeholders/reminder.txt',
                lambda a: days_before(7, c.PLACEHOLDER_DEADLINE) and a.placeholder and a.first_name and a.last_name
-                                                                and not a.is_dealer)
+                                                                and not a.is_dealer,
+               criteria=[Attendee.placeholder == True])
 
 
 # Volunteer emails; none of these will be sent unless SHIFTS_CREATED is set.
@@ -214,11 +454,11 @@ StopsEmail('{EVENT_NAME} shifts available', 'shifts/created.txt',
 
 StopsEmail('Reminder to sign up for {EVENT_NAME} shifts', 'shifts/reminder.txt',
            lambda a: c.AFTER_SHIFTS_CREATED and days_after(30, max(a.registered_local, c.SHIFTS_CREATED))
-                 and c.BEFORE_PREREG_TAKEDOWN and a.takes_shifts and not a.hours)
+                 and c.BEFORE_PREREG_TAKEDOWN and a.takes_shifts and not a.hours, needs=['shifts.job'], coalescible=True)
 
 StopsEmail('Last chance to sign up for {EVENT_NAME} shifts', 'shifts/reminder.txt',
               lambda a: days_before(10, c.EPOCH) and c.AFTER_SHIFTS_CREATED and c.BEFORE_PREREG_TAKEDOWN
-                                                 and a.takes_shifts and not a.hours)
+                                                 and a.takes_shifts and not a.hours, needs=['shifts.job'])
 
 StopsEmail('Still want to volunteer at {EVENT_NAME}?', 'shifts/volunteer_check.txt',
               lambda a: c.SHIFTS_CREATED and days_before(5, c.UBER_TAKEDOWN)
@@ -231,16 +471,16 @@ StopsEmail('Want volunteer hotel room space at {EVENT_NAME}?', 'shifts/hotel_roo
            lambda a: days_before(45, c.ROOM_DEADLINE, 14) and c.AFTER_SHIFTS_CREATED and a.hotel_eligible)
 
 StopsEmail('Reminder to sign up for {EVENT_NAME} hotel room space', 'shifts/hotel_reminder.txt',
-           lambda a: days_before(14, c.ROOM_DEADLINE, 2) and a.hotel_eligible and not a.hotel_requests)
+           lambda a: days_before(14, c.ROOM_DEADLINE, 2) and a.hotel_eligible and not a.hotel_requests, needs=['hotel_requests'], coalescible=True)
 
 StopsEmail('Last chance to sign up for {EVENT_NAME} hotel room space', 'shifts/hotel_reminder.txt',
-           lambda a: days_before(2, c.ROOM_DEADLINE) and a.hotel_eligible and not a.hotel_requests)
+           lambda a: days_before(2, c.ROOM_DEADLINE) and a.hotel_eligible and not a.hotel_requests, needs=['hotel_requests'])
 
 StopsEmail('Reminder to meet your {EVENT_NAME} hotel room requirements', 'shifts/hotel_hours.txt',
-           lambda a: days_before(14, c.UBER_TAKEDOWN, 7) and a.hotel_shifts_required and a.weighted_hours < 30)
+           lambda a: days_before(14, c.UBER_TAKEDOWN, 7) and a.hotel_shifts_required and a.weighted_hours < 30, needs=['hotel_requests'], coalescible=True)
 
 StopsEmail('Final reminder to meet your {EVENT_NAME} hotel room requirements', 'shifts/hotel_hours.txt',
-           lambda a: days_before(7, c.UBER_TAKEDOWN) and a.hotel_shifts_required and a.weighted_hours < 30)
+           lambda a: days_before(7, c.UBER_TAKEDOWN) and a.hotel_shifts_required and a.weighted_hours < 30, needs=['hotel_requests'])
 
 
 # For events with customized badges, these emails remind people to let us know what we want on their badges.  We have
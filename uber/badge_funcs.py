@@ -29,19 +29,76 @@ def get_badge_type(badge_num):
             return None, '{0!r} is not a valid integer'.format(badge_num)
 
 
+def _same_person(a, b):
+    """
+    Two attendees which share either a name key or an email key are considered
+    the same person if the other key is also equal or is only a typo or two
+    away, i.e. within a small edit distance (on the local part for emails).
+    """
+    if a.name_key != b.name_key and edit_distance(a.name_key, b.name_key, limit=2) > (1 if len(a.name_key) < 10 else 2):
+        return False
+    if a.email_key != b.email_key:
+        (a_local, _, a_domain), (b_local, _, b_domain) = a.email_key.rpartition('@'), b.email_key.rpartition('@')
+        return bool(a_local) and a_domain == b_domain and edit_distance(a_local, b_local, limit=1) <= 1
+    return True
+
+
+def find_duplicates(session, since=None):
+    """
+    Returns a dict mapping (full_name, email) to lists of attendees which we
+    think are the same person, ordered by when they registered.  Rather than
+    comparing everyone against everyone, we only compare each attendee against
+    others sharing their name_key or email_key, and if a "since" datetime is
+    given then we only look for duplicates of attendees whose keys have changed
+    since then.
+    """
+    named = session.query(Attendee).filter(Attendee.first_name != '')
+    if since:
+        touched = named.filter(Attendee.identity_updated > since).all()
+        if not touched:
+            return {}
+        name_keys, email_keys = {a.name_key for a in touched}, {a.email_key for a in touched if a.email_key}
+        candidates = named.filter(or_(Attendee.name_key.in_(name_keys), Attendee.email_key.in_(email_keys)))
+    else:
+        candidates = named
+    candidates = [a for a in candidates.options(joinedload(Attendee.group)).order_by(Attendee.registered)
+                  if not a.group or a.group.status != c.WAITLISTED]
+    if not since:
+        for attendee in candidates:
+            attendee._identity_keys()  # fills in keys for attendees saved before we started storing them
+        touched = candidates
+
+    by_name, by_email = defaultdict(list), defaultdict(list)
+    for attendee in candidates:
+        by_name[attendee.name_key].append(attendee)
+        by_email[attendee.email_key].append(attendee)
+
+    unions = UnionFind(candidates)
+    for attendee in touched:
+        if attendee in unions.parent:
+            for other in chain(by_name[attendee.name_key], by_email[attendee.email_key] if attendee.email_key else []):
+                if other is not attendee and _same_person(attendee, other):
+                    unions.union(attendee, other)
+
+    registered = {attendee: i for i, attendee in enumerate(candidates)}
+    dupes = {}
+    for group in unions.groups():
+        if len(group) > 1:
+            group.sort(key=registered.get)
+            dupes[group[0].full_name, group[0].email.lower()] = group
+    return dupes
+
+
 def detect_duplicates():
     if c.PRE_CON and (c.DEV_BOX or c.SEND_EMAILS):
         subject = c.EVENT_NAME + ' Duplicates Report for ' + localized_now().strftime('%Y-%m-%d')
         with Session() as session:
             if session.no_email(subject):
-                grouped = defaultdict(list)
-                for a in session.query(Attendee).filter(Attendee.first_name != '').options(joinedload(Attendee.group)).order_by(Attendee.registered):
-                    if not a.group or a.group.status != c.WAITLISTED:
-                        grouped[a.full_name, a.email.lower()].append(a)
+                # we only need to check attendees who've changed since our last report
+                last_report = session.query(func.max(Email.when)).filter(Email.subject.startswith(c.EVENT_NAME + ' Duplicates Report for ')).scalar()
+                dupes = find_duplicates(session, since=last_report)
 
-                dupes = {k: v for k, v in grouped.items() if len(v) > 1}
-
-                for who, attendees in dupes.items():
+                for who, attendees in list(dupes.items()):
                     paid = [a for a in attendees if a.paid == c.HAS_PAID]
                     unpaid = [a for a in attendees if a.paid == c.NOT_PAID]
                     if len(paid) == 1 and len(attendees) == 1 + len(unpaid):
@@ -61,7 +118,7 @@ def check_placeholders():
             ['Panelist', c.PANELS_EMAIL, or_(Attendee.badge_type == c.GUEST_BADGE, Attendee.ribbon == c.PANELIST_RIBBON)],
             ['Attendee', c.REGDESK_EMAIL, not_(or_(Attendee.staffing == True, Attendee.badge_type == c.GUEST_BADGE, Attendee.ribbon == c.PANELIST_RIBBON))]
         ]
-        with Session() as session:
+        with Session.read_only() as session:
             for badge_type, dest, per_email_filter in emails:
                 weeks_until = (c.EPOCH - localized_now()).days // 7
                 subject = '{} {} Placeholder Badge Report ({} weeks to go)'.format(c.EVENT_NAME, badge_type, weeks_until)
@@ -79,10 +136,10 @@ def check_placeholders():
 
 def check_unassigned():
     if c.PRE_CON and (c.DEV_BOX or c.SEND_EMAILS):
-        with Session() as session:
-            unassigned = session.query(Attendee).filter_by(staffing=True, assigned_depts='').order_by(Attendee.full_name).all()
+        with Session.read_only() as session:
             subject = c.EVENT_NAME + ' Unassigned Volunteer Report for ' + localized_now().strftime('%Y-%m-%d')
-            if unassigned and session.no_email(subject):
+            unassigned = session.no_email(subject) and session.query(Attendee).filter_by(staffing=True, assigned_depts='').order_by(Attendee.full_name).all()
+            if unassigned:
                 body = render('emails/daily_checks/unassigned.html', {'unassigned': unassigned})
                 send_email(c.STAFF_EMAIL, c.STAFF_EMAIL, subject, body, format='html', model='n/a')
 
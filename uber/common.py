@@ -9,28 +9,39 @@ import socket
 import random
 import inspect
 import binascii
+import hmac
+import argparse
 import warnings
 import importlib
 import mimetypes
 import threading
 import traceback
+import multiprocessing
 from glob import glob
 from uuid import uuid4
 from io import StringIO
 from pprint import pprint
+from bisect import bisect_left
 from copy import deepcopy
 from pprint import pformat
 from hashlib import sha512
 from functools import wraps
 from xml.dom import minidom
 from random import randrange
-from contextlib import closing
-from time import sleep, mktime
+from contextlib import closing, contextmanager
+from time import sleep, mktime, monotonic
 from urllib.parse import quote
 from urllib.parse import urlparse
 from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, build_opener, HTTPCookieProcessor
+from http.cookiejar import CookieJar
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain, count
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, OrderedDict, Counter
 from datetime import date, time, datetime, timedelta
 from threading import Thread, RLock, local, current_thread
 from os.path import abspath, basename, dirname, exists, join
@@ -48,17 +59,19 @@ from django.utils.text import normalize_newlines
 from django.template import loader, Context, Variable, TemplateSyntaxError
 
 import sqlalchemy
-from sqlalchemy.sql import case
+from sqlalchemy.sql import case, bindparam
 from sqlalchemy.event import listen
-from sqlalchemy.ext import declarative
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.ext import declarative, baked
 from sqlalchemy import func, or_, and_, not_
 from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.sql.expression import FunctionElement
-from sqlalchemy.orm.attributes import get_history, instance_state
+from sqlalchemy.sql.expression import FunctionElement, Executable, ClauseElement
+from sqlalchemy.orm.attributes import get_history, instance_state, InstrumentedAttribute
 from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint
-from sqlalchemy.orm import Query, relationship, joinedload, backref
+from sqlalchemy.orm import Query, relationship, joinedload, subqueryload, backref
 from sqlalchemy.types import Boolean, Integer, Float, TypeDecorator, Date
 
 from sideboard.lib import log, parse_config, entry_point, listify, DaemonTask, serializer, cached_property, stopped, on_startup
@@ -69,12 +82,21 @@ import uber as sa  # used to avoid circular dependency import issues for SQLAlch
 from uber.amazon_ses import AmazonSES, EmailMessage  # TODO: replace this after boto adds Python 3 support
 from uber.config import c, Config
 from uber.utils import *
+from uber.metrics import *
 from uber.decorators import *
 from uber.models import *
 from uber.automated_emails import *
 from uber.badge_funcs import *
+from uber.roommates import *
+from uber.room_planner import *
+from uber.worker import *
 from uber import model_checks
 from uber import custom_tags
 from uber import server
 from uber import sep_commands
 from uber.tests import import_test_data
+from uber.tests import synthetic
+from uber.tests import benchmarks
+from uber.tests import load_test
+from uber.tests import replay
+from uber.tests import query_plans
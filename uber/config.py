@@ -361,3 +361,5 @@ c.WRISTBAND_COLORS = defaultdict(lambda: c.WRISTBAND_COLORS[c.DEFAULT_WRISTBAND]
 c.SAME_NUMBER_REPEATED = r'^(\d)\1+$'
 
 stripe.api_key = c.STRIPE_SECRET_KEY
+if c.STRIPE_API_BASE:
+    stripe.api_base = c.STRIPE_API_BASE
@@ -70,6 +70,7 @@ def ajax(func):
         assert cherrypy.request.method == 'POST', 'POST required, got {}'.format(cherrypy.request.method)
         check_csrf(kwargs.pop('csrf_token', None))
         return json.dumps(func(*args, **kwargs), cls=serializer).encode('utf-8')
+    returns_json.metric_kind = 'ajax'
     return returns_json
 
 
@@ -84,6 +85,7 @@ def ajax_gettable(func):
     def returns_json(*args, **kwargs):
         cherrypy.response.headers['Content-Type'] = 'application/json'
         return json.dumps(func(*args, **kwargs), cls=serializer).encode('utf-8')
+    returns_json.metric_kind = 'ajax'
     return returns_json
 
 
@@ -95,6 +97,8 @@ def csv_file(func):
         writer = StringIO()
         func(self, csv.writer(writer), session)
         return writer.getvalue().encode('utf-8')
+    csvout.metric_kind = 'csv'
+    csvout.read_only = getattr(func, 'read_only', True)
     return csvout
 
 
@@ -151,23 +155,370 @@ def cached_page(func):
     return with_caching
 
 
+def report_job(*models):
+    """
+    Marks a heavy report page to be generated in the background by a ReportJob
+    rather than by the CherryPy thread which handles the request.  The finished
+    report is reused until something in the given models' tables changes.
+    """
+    def decorator(func):
+        func.report_job = models
+        return func
+    return decorator
+
+
+def report_progress(done, total):
+    """Lets a page running as a ReportJob say how far along it is, which is shown to whoever is waiting for it."""
+    job = getattr(ReportJob.current, 'job', None)
+    if job:
+        job.done, job.total = done, total
+
+
+class ReportJob:
+    """
+    One run of a page marked with @report_job.  These run in their own small
+    thread pool, so however many reports people ask for at once, they can't
+    take the CherryPy threads and database connections we need for check-in;
+    each job uses a single read-only session, so c.REPORT_WORKERS is also the
+    most database connections reports can hold at once.
+
+    Jobs are keyed by page, parameters, and (except for CSV files) the admin
+    who asked, and the latest job for each key is kept until the data it was
+    generated from changes, so everyone asking for the same report while it's
+    being generated or after it's done gets that one.  Since changes saved by
+    other app nodes don't show up in our data versions, we also stop reusing a
+    report once it's c.REPORT_MAX_AGE seconds old, and whenever we start a new
+    job we throw away every report which has reached that age.  Finished reports
+    are saved to disk rather than held in memory.
+    """
+    lock = RLock()
+    current = local()
+    executor = ThreadPoolExecutor(max_workers=c.REPORT_WORKERS)
+    wait_seconds = 2  # how long a request waits for its report before showing the progress page
+    storage_dir = None  # defaults to the "reports" subdirectory of our data directory
+    jobs = {}    # id -> ReportJob
+    latest = {}  # key -> ReportJob
+
+    def __init__(self, func, key, version, args, kwargs):
+        self.id, self.func, self.key, self.version, self.args, self.kwargs = uuid4().hex, func, key, version, args, kwargs
+        self.name = func.__name__
+        self.path, self.query_string = cherrypy.request.path_info, cherrypy.request.query_string
+        self.session_data = dict(cherrypy.session.items())
+        self.started, self.elapsed, self.done, self.total = monotonic(), None, 0, 0
+        self.headers, self.error = {}, None
+        self.finished = threading.Event()
+
+    @classmethod
+    def start(cls, func, models, args, kwargs):
+        """Returns the job for this report, starting a new one if there isn't one with up-to-date data."""
+        params = tuple(sorted((name, tuple(listify(value))) for name, value in kwargs.items()))  # repeated params are lists
+        key = (func.__module__, func.__name__, params,
+               None if getattr(func, 'metric_kind', None) == 'csv' else cherrypy.session.get('account_id'))
+        version = sa.Session.data_version(*models)  # read this before generating, so concurrent changes make our result stale
+        with cls.lock:
+            job = cls.latest.get(key)
+            if not job or job.finished.is_set() and (job.error or job.version != version or job.expired):
+                cls.prune()
+                if key in cls.latest:
+                    cls.latest.pop(key).discard()
+                job = cls.latest[key] = cls(func, key, version, args, kwargs)
+                cls.jobs[job.id] = job
+                cls.executor.submit(job.run)
+            return job
+
+    @classmethod
+    def prune(cls):
+        """Discards every finished report which is too old to be reused, along with its saved file."""
+        with cls.lock:
+            for key, job in list(cls.latest.items()):
+                if job.expired:
+                    del cls.latest[key]
+                    job.discard()
+
+    @property
+    def expired(self):
+        return self.finished.is_set() and monotonic() - self.started > c.REPORT_MAX_AGE
+
+    @property
+    def filename(self):
+        from sideboard.lib import config as sideboard_config
+        directory = self.storage_dir or os.path.join(sideboard_config['root'], 'data', 'reports')
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, self.id)
+
+    @property
+    def percent(self):
+        return int(100 * self.done / self.total) if self.total else None
+
+    def run(self):
+        self.current.job = self
+        try:
+            with simulated_request('GET', self.path, self.query_string, **self.session_data):
+                with sa.Session.read_only() as session:
+                    body = self.func(*self.args, session=session, **self.kwargs)
+                self.headers = {name: cherrypy.response.headers[name] for name in ['Content-Type', 'Content-Disposition']
+                                if name in cherrypy.response.headers}
+            with open(self.filename, 'wb') as f:
+                f.write(body if isinstance(body, bytes) else str(body).encode('utf-8'))
+        except:
+            log.error('unable to generate {} report', self.name, exc_info=True)
+            self.error = traceback.format_exc()
+        finally:
+            self.current.job = None
+            self.elapsed = monotonic() - self.started
+            self.finished.set()
+
+    def result(self):
+        for name, value in self.headers.items():
+            cherrypy.response.headers[name] = value
+        with open(self.filename, 'rb') as f:
+            return f.read()
+
+    def discard(self):
+        self.jobs.pop(self.id, None)
+        if exists(self.filename):
+            os.remove(self.filename)
+
+
+def background_report(func):
+    models = getattr(func, 'report_job', None)
+    if models is None:
+        return func
+
+    @wraps(func)
+    def with_job(*args, report_job=None, session=None, **kwargs):
+        job = ReportJob.jobs.get(report_job) if report_job else ReportJob.start(func, models, args, kwargs)
+        if not job:
+            raise HTTPRedirect(cherrypy.request.path_info.split('/')[-1])
+
+        job.finished.wait(ReportJob.wait_seconds)
+        if job.finished.is_set() and not job.error:
+            return job.result()
+        else:
+            return render('report_job.html', {'job': job, 'running': monotonic() - job.started})
+    return with_job
+
+
+class QueryProfile:
+    """
+    Records every SQL statement run by the current thread while it's active,
+    via the engine listeners in models.py.  We keep a count of each statement
+    "shape", i.e. the statement with its parameters and IN lists collapsed, since
+    the same shape being run over and over is almost always an N+1 lazy load.
+
+    When a profile finishes, its totals are added to the per-handler stats that
+    are shown on the devtools query_profiles page.
+    """
+    _local = local()
+    _params = re.compile(r"%\(\w+\)s|:\w+|\?|'(?:[^']|'')*'|\b\d+\b")
+    _lists = re.compile(r'\?(?:\s*,\s*\?)+')
+
+    lock = RLock()
+    stats = {}  # handler name -> dict of totals and maximums
+
+    def __init__(self, name):
+        self.name = name
+        self.queries, self.db_time, self.elapsed = 0, 0.0, 0.0
+        self.shapes = Counter()
+
+    @classmethod
+    def current(cls):
+        return getattr(cls._local, 'profile', None)
+
+    @classmethod
+    def shape(cls, statement):
+        return cls._lists.sub('?', cls._params.sub('?', ' '.join(statement.split())))
+
+    def record(self, statement, duration):
+        self.queries += 1
+        self.db_time += duration
+        self.shapes[self.shape(statement)] += 1
+
+    @property
+    def repeated(self):
+        """Returns (shape, count) tuples for every statement shape run at least c.N_PLUS_ONE_THRESHOLD times."""
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= c.N_PLUS_ONE_THRESHOLD]
+
+    def __enter__(self):
+        self.outer, self._local.profile = self.current(), self
+        self.started = monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = monotonic() - self.started
+        self._local.profile = self.outer
+        if self.outer:
+            self.outer.queries += self.queries
+            self.outer.db_time += self.db_time
+            self.outer.shapes.update(self.shapes)
+        else:
+            self.finish()
+
+    def finish(self):
+        repeated = self.repeated
+        with self.lock:
+            stats = self.stats.setdefault(self.name, {'name': self.name, 'calls': 0, 'queries': 0, 'db_time': 0.0, 'elapsed': 0.0,
+                                                      'max_queries': 0, 'max_db_time': 0.0, 'n_plus_one': 0, 'worst_shape': ''})
+            stats['calls'] += 1
+            stats['queries'] += self.queries
+            stats['db_time'] += self.db_time
+            stats['elapsed'] += self.elapsed
+            stats['max_queries'] = max(stats['max_queries'], self.queries)
+            stats['max_db_time'] = max(stats['max_db_time'], self.db_time)
+            if repeated:
+                stats['n_plus_one'] += 1
+                stats['worst_shape'] = repeated[0][0]
+
+        message = 'handler={} seconds={:.3f} queries={} db_seconds={:.3f} repeated={}'
+        args = [self.name, self.elapsed, self.queries, self.db_time, [n for shape, n in repeated]]
+        if repeated:
+            log.warning(message + ' worst={!r}', *(args + [repeated[0][0]]))
+        else:
+            log.debug(message, *args)
+
+    @property
+    def header(self):
+        return 'queries={}; db={:.1f}ms; total={:.1f}ms; repeated={}'.format(
+            self.queries, 1000 * self.db_time, 1000 * self.elapsed, len(self.repeated))
+
+
+class IndexAdvisor:
+    """
+    Records which columns our SQL statements filter, join, and sort on, via the
+    same engine listeners as QueryProfile, so that we can recommend indexes for
+    the columns we use most which no existing index leads with.  Columns are
+    read from the generated SQL, where SQLAlchemy always qualifies them with
+    their table or alias, e.g. "attendee.badge_num = ?" or
+    "lower(attendee.email) = lower(?)".
+    """
+    _aliases = re.compile(r'(?:FROM|JOIN|,)\s+"?(\w+)"?\s+AS\s+"?(\w+)"?')
+    _filters = re.compile(r'(\blower\()?"?(\w+)"?\."?(\w+)"?\)?\s*(?:=|!=|<>|<=|>=|<|>|\bIN\b|\bNOT IN\b|\bLIKE\b|\bILIKE\b|\bIS\b|\bBETWEEN\b)', re.I)
+    _compared = re.compile(r'(?:=|<>|<|>)\s*(\blower\()?"?(\w+)"?\."?(\w+)"?')  # the other side of e.g. join conditions
+    _order_by = re.compile(r'\bORDER BY\s+(.+?)(?:\s+LIMIT\b|\s+OFFSET\b|\)|$)', re.I | re.S)
+    _order_columns = re.compile(r'(\blower\()?"?(\w+)"?\."?(\w+)"?')
+
+    lock = RLock()
+    usage = {}  # (table, column or expression) -> {'filter': uses, 'order': uses, 'db_time': seconds}
+    _parsed = {}  # statement -> set of (table, key, kind), since the same statements are run over and over
+
+    @classmethod
+    def parse(cls, statement):
+        """Returns a set of (table, column or expression, "filter" or "order") tuples used by the statement."""
+        aliases = {alias: table for table, alias in cls._aliases.findall(statement)}
+        used = set()
+        matches = [('filter', m) for m in cls._filters.findall(statement) + cls._compared.findall(statement)]
+        for clause in cls._order_by.findall(statement):
+            matches.extend(('order', m) for m in cls._order_columns.findall(clause))
+        for kind, (lower, table, column) in matches:
+            key = 'lower({})'.format(column) if lower else column
+            used.add((aliases.get(table, table), key, kind))
+        return used
+
+    @classmethod
+    def record(cls, statement, duration):
+        used = cls._parsed.get(statement)
+        if used is None:
+            used = cls.parse(statement)
+            if len(cls._parsed) >= 10000:
+                cls._parsed.clear()
+            cls._parsed[statement] = used
+        with cls.lock:
+            for table, key, kind in used:
+                stats = cls.usage.setdefault((table, key), {'filter': 0, 'order': 0, 'db_time': 0.0})
+                stats[kind] += 1
+                stats['db_time'] += duration
+
+    @staticmethod
+    def leading_keys(table):
+        """Returns the columns and expressions which an existing index or key of the table starts with."""
+        keys = {col.name for col in list(table.primary_key)[:1]}
+        for index in table.indexes:
+            keys.add(re.sub(r'\w+\.', '', str(index.expressions[0])) if index.expressions else list(index.columns)[0].name)
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint) and constraint.columns:
+                keys.add(list(constraint.columns)[0].name)
+        return keys
+
+    @classmethod
+    def recommendations(cls, min_uses=None):
+        """
+        Returns a list of dicts describing every column or expression which was
+        used at least min_uses times and which no index leads with, along with
+        the DDL to create an index for it, most expensive first.
+        """
+        min_uses = c.INDEX_ADVISOR_MIN_USES if min_uses is None else min_uses
+        tables = {model.__table__.name: model.__table__ for model in sa.Session.all_models()}
+        with cls.lock:
+            usage = [(table, key, dict(stats)) for (table, key), stats in cls.usage.items()]
+        advice = []
+        for table, key, stats in usage:
+            if table in tables and stats['filter'] + stats['order'] >= min_uses and key not in cls.leading_keys(tables[table]):
+                name = 'ix_{}_{}'.format(table, re.sub(r'\W+', '_', key).strip('_'))
+                advice.append(dict(stats, table=table, key=key, name=name,
+                                   ddl='CREATE INDEX {} ON "{}" ({});'.format(name, table, key)))
+        return sorted(advice, key=lambda stats: stats['db_time'], reverse=True)
+
+
 def timed(func):
+    """
+    Profiles the SQL run by a page handler (see QueryProfile) and records its
+    latency in our metrics, labeled with the kind of handler it is: a page, or
+    an @ajax or @csv_file handler.
+    """
+    name, kind = '{}.{}'.format(func.__module__, func.__name__), getattr(func, 'metric_kind', 'page')
+
     @wraps(func)
     def with_timing(*args, **kwargs):
-        before = datetime.now()
-        try:
-            return func(*args, **kwargs)
-        finally:
-            log.debug('{}.{} loaded in {} seconds'.format(func.__module__, func.__name__, (datetime.now() - before).total_seconds()))
+        outcome = 'error'
+        with QueryProfile(name) as profile:
+            try:
+                result = func(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            except cherrypy.HTTPRedirect:
+                outcome = 'redirect'
+                raise
+            finally:
+                profile.elapsed = monotonic() - profile.started
+                metrics.observe('uber_request_seconds', profile.elapsed, handler=name, kind=kind)
+                metrics.observe('uber_request_db_seconds', profile.db_time, handler=name, kind=kind)
+                metrics.inc('uber_requests_total', handler=name, kind=kind, outcome=outcome)
+                if c.QUERY_PROFILE_HEADER:
+                    cherrypy.response.headers['X-Query-Profile'] = profile.header
     return with_timing
 
 
+def read_only(func):
+    """
+    Marks a page handler as never writing to the database, so that it gets a
+    read-only session; see Session.read_only for what that means.
+    """
+    func.read_only = True
+    return func
+
+
+def read_write(func):
+    """Marks a page handler as writing to the database even for GET requests, which matters when c.READ_ONLY_GETS is on."""
+    func.read_only = False
+    return func
+
+
+def is_read_only(func):
+    read_only = getattr(get_innermost(func), 'read_only', None)
+    if read_only is None:
+        return c.READ_ONLY_GETS and cherrypy.request.method == 'GET'
+    return read_only
+
+
 def sessionized(func):
     @wraps(func)
     def with_session(*args, **kwargs):
         innermost = get_innermost(func)
         if 'session' not in inspect.getfullargspec(innermost).args:
             return func(*args, **kwargs)
+        elif is_read_only(func):
+            with sa.Session.read_only() as session:
+                return func(*args, session=session, **kwargs)
         else:
             with sa.Session() as session:
                 try:
@@ -260,14 +611,16 @@ def restricted(func):
 
 
 class all_renderable:
-    def __init__(self, *needs_access):
+    def __init__(self, *needs_access, read_only=None):
         self.needs_access = needs_access
+        self.read_only = read_only
 
     def __call__(self, klass):
         for name, func in klass.__dict__.items():
             if hasattr(func, '__call__'):
                 func.restricted = getattr(func, 'restricted', self.needs_access)
-                new_func = timed(cached_page(sessionized(restricted(renderable(func)))))
+                get_innermost(func).read_only = getattr(func, 'read_only', self.read_only)
+                new_func = timed(cached_page(sessionized(restricted(background_report(renderable(func))))))
                 new_func.exposed = True
                 setattr(klass, name, new_func)
         return klass
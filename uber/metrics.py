@@ -0,0 +1,131 @@
+"""
+A minimal in-process metrics registry, so that we can see latency percentiles for our page handlers and background
+tasks and how close we are to running out of database connections.  Everything is exposed in the Prometheus text format
+by the devtools metrics page; percentiles are computed from the histogram buckets by whatever scrapes that page.
+
+Each process keeps its own metrics, so when running several app nodes or a separate worker process, each of them must
+be scraped separately.
+"""
+from uber.common import *
+
+
+class Histogram:
+    """Counts observed values into fixed buckets, as well as keeping their count and sum."""
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or self.default_buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count, self.sum = 0, 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            self.counts[i] += 1
+
+    def cumulative(self):
+        """Returns (upper bound, count) tuples in the cumulative form Prometheus expects, ending with +Inf."""
+        total, result = 0, []
+        for bucket, n in zip(self.buckets, self.counts):
+            total += n
+            result.append((repr(float(bucket)), total))
+        return result + [('+Inf', self.count)]
+
+
+class MetricsRegistry:
+    """
+    Holds counters and histograms keyed by metric name and labels, plus gauges,
+    which are functions called whenever we render our metrics.  Every metric
+    must be declared with describe() before it's recorded.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.declared = OrderedDict()  # name -> (type, help)
+        self.values = defaultdict(dict)  # name -> {sorted label tuples: number or Histogram}
+        self.gauges = {}
+
+    def describe(self, name, type, help):
+        assert type in ['counter', 'histogram', 'gauge'], 'unknown metric type {!r}'.format(type)
+        self.declared[name] = (type, help)
+
+    def inc(self, name, amount=1, **labels):
+        assert self.declared[name][0] == 'counter', '{} is not a counter'.format(name)
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[name][key] = self.values[name].get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        assert self.declared[name][0] == 'histogram', '{} is not a histogram'.format(name)
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            if key not in self.values[name]:
+                self.values[name][key] = Histogram()
+            self.values[name][key].observe(value)
+
+    def gauge(self, name, help, func):
+        self.describe(name, 'gauge', help)
+        self.gauges[name] = func
+
+    @staticmethod
+    def format_labels(labels):
+        escape = lambda value: str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        return '{' + ','.join('{}="{}"'.format(k, escape(v)) for k, v in labels) + '}' if labels else ''
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (type, help) in self.declared.items():
+                lines.extend(['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, type)])
+                if type == 'gauge':
+                    try:
+                        lines.append('{} {}'.format(name, float(self.gauges[name]())))
+                    except:
+                        log.warning('unable to read gauge {}', name, exc_info=True)
+                for labels, value in sorted(self.values[name].items()):
+                    if type == 'histogram':
+                        for le, n in value.cumulative():
+                            lines.append('{}_bucket{} {}'.format(name, self.format_labels(labels + (('le', le),)), n))
+                        lines.append('{}_sum{} {}'.format(name, self.format_labels(labels), value.sum))
+                        lines.append('{}_count{} {}'.format(name, self.format_labels(labels), value.count))
+                    else:
+                        lines.append('{}{} {}'.format(name, self.format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+metrics.describe('uber_request_seconds', 'histogram', 'Time spent handling each request, by page handler.')
+metrics.describe('uber_request_db_seconds', 'histogram', 'Time spent waiting on SQL statements during each request, by page handler.')
+metrics.describe('uber_requests_total', 'counter', 'Requests handled, by page handler and outcome (ok, redirect, or error).')
+metrics.describe('uber_task_seconds', 'histogram', 'Time spent on each run of a background task.')
+metrics.describe('uber_task_runs_total', 'counter', 'Background task runs, by task and outcome (ok or error).')
+metrics.describe('uber_db_pool_checkout_seconds', 'histogram', 'Time spent waiting to check a connection out of the database pool.')
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool which records how long each connection checkout waits, e.g. when all connections are in use."""
+
+    def _do_get(self):
+        started = monotonic()
+        try:
+            return QueuePool._do_get(self)
+        finally:
+            metrics.observe('uber_db_pool_checkout_seconds', monotonic() - started)
+
+
+def metered_task(func):
+    """Wraps a background task function so that each of its runs is recorded in our metrics."""
+    name = getattr(func, '__qualname__', func.__name__)
+
+    @wraps(func)
+    def with_metrics(*args, **kwargs):
+        started, outcome = monotonic(), 'error'
+        try:
+            result = func(*args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            metrics.observe('uber_task_seconds', monotonic() - started, task=name)
+            metrics.inc('uber_task_runs_total', task=name, outcome=outcome)
+    return with_metrics
@@ -27,12 +27,16 @@ def Column(*args, admin_only=False, **kwargs):
     the column instance, indicating whether the column should be settable by
     regular attendees filling out one of the registration forms or if only a
     logged-in admin user should be able to set it.
+
+    Pass index=True for a plain single-column index, which is named
+    ix_<table>_<column>; indexes on several columns or on expressions, and
+    partial indexes, are declared with MagModel.declare_index instead.
     """
     kwargs.setdefault('nullable', False)
     if args[0] is UnicodeText or isinstance(args[0], (UnicodeText, MultiChoice)):
         kwargs.setdefault('default', '')
     default = kwargs.get('default')
-    if isinstance(default, (int, str)):
+    if isinstance(default, (int, str)) and not isinstance(args[0], MultiChoice):  # '' isn't a valid Postgres array
         kwargs.setdefault('server_default', str(default))
     col = SQLAlchemyColumn(*args, **kwargs)
     col.admin_only = admin_only or args[0] in [UUID, UTCDateTime]
@@ -121,15 +125,88 @@ class MultiChoice(TypeDecorator):
     is represented by an integer, so we store them as a comma-separated string.
     This can be marginally more convenient than a many-to-many table.  Like the
     Choice class, this takes an array of tuples of integers and strings.
+
+    On Postgres these are stored as integer arrays instead, so that they can be
+    searched with a GIN index, but their values are still comma-separated
+    strings in Python either way.  Query these columns with has_any() and
+    has_all() rather than LIKE, which also matches e.g. 12 when looking for 1:
+
+        session.query(Attendee).filter(Attendee.assigned_depts.has_any(c.CONSOLE))
     """
     impl = UnicodeText
 
+    class comparator_factory(TypeDecorator.Comparator):
+        def has_any(self, *values):
+            """Matches rows which have at least one of the given values."""
+            return multichoice_has_any(self.expr, *[int(value) for value in values])
+
+        def has_all(self, *values):
+            """Matches rows which have every one of the given values."""
+            return multichoice_has_all(self.expr, *[int(value) for value in values])
+
     def __init__(self, choices, **kwargs):
         self.choices = choices
         TypeDecorator.__init__(self, **kwargs)
 
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(ARRAY(Integer))
+        else:
+            return dialect.type_descriptor(self.impl)
+
     def process_bind_param(self, value, dialect):
-        return value if isinstance(value, str) else ','.join(value)
+        if value is None:
+            return None
+        values = value.split(',') if isinstance(value, str) else listify(value)
+        if dialect.name == 'postgresql':
+            return [int(val) for val in values if str(val).strip()]
+        else:
+            return value if isinstance(value, str) else ','.join(map(str, values))
+
+    def process_result_value(self, value, dialect):
+        return ','.join(map(str, value)) if isinstance(value, list) else value
+
+
+class multichoice_has_any(FunctionElement):
+    type = Boolean()
+    name = 'multichoice_has_any'
+
+
+class multichoice_has_all(FunctionElement):
+    type = Boolean()
+    name = 'multichoice_has_all'
+
+
+def _multichoice_args(element, compiler, **kw):
+    column, *values = element.clauses
+    return compiler.process(column, **kw), [compiler.process(value, **kw) for value in values]
+
+
+@compiles(multichoice_has_any, 'postgresql')
+def pg_multichoice_has_any(element, compiler, **kw):
+    column, values = _multichoice_args(element, compiler, **kw)
+    return '({} && ARRAY[{}]::integer[])'.format(column, ', '.join(values))
+
+
+@compiles(multichoice_has_all, 'postgresql')
+def pg_multichoice_has_all(element, compiler, **kw):
+    column, values = _multichoice_args(element, compiler, **kw)
+    return '({} @> ARRAY[{}]::integer[])'.format(column, ', '.join(values))
+
+
+def _sqlite_multichoice_matches(element, compiler, **kw):
+    column, values = _multichoice_args(element, compiler, **kw)
+    return ["(',' || {} || ',' LIKE '%,' || {} || ',%')".format(column, value) for value in values]
+
+
+@compiles(multichoice_has_any, 'sqlite')
+def sqlite_multichoice_has_any(element, compiler, **kw):
+    return '({})'.format(' OR '.join(_sqlite_multichoice_matches(element, compiler, **kw)) or '0')
+
+
+@compiles(multichoice_has_all, 'sqlite')
+def sqlite_multichoice_has_all(element, compiler, **kw):
+    return '({})'.format(' AND '.join(_sqlite_multichoice_matches(element, compiler, **kw)) or '1')
 
 
 @declarative_base
@@ -138,6 +215,18 @@ class MagModel:
 
     required = ()
 
+    @classmethod
+    def declare_index(cls, name, *expressions, where=None, unique=False, using=None):
+        """
+        Adds an index to this model's table which can't be declared with
+        Column(index=True), e.g. one spanning several columns, one on an
+        expression such as func.lower(Attendee.email), or a partial index which
+        only covers rows matching the "where" clause.  Partial indexes are only
+        partial on Postgres; SQLite gets a regular index on the same columns.
+        The same goes for "using", e.g. using='gin' for MultiChoice columns.
+        """
+        return sqlalchemy.Index(name, *expressions, unique=unique, postgresql_where=where, postgresql_using=using)
+
     def __init__(self, *args, **kwargs):
         if '_model' in kwargs:
             assert kwargs.pop('_model') == self.__class__.__name__
@@ -414,7 +503,14 @@ class NightsMixin(object):
 
 
 class Session(SessionManager):
-    engine = sqlalchemy.create_engine(c.SQLALCHEMY_URL, pool_size=50, max_overflow=100)
+    pool_size, max_overflow = 50, 100
+    engine = sqlalchemy.create_engine(c.SQLALCHEMY_URL, pool_size=pool_size, max_overflow=max_overflow, poolclass=TimedQueuePool)
+    replica_engine = c.REPLICA_SQLALCHEMY_URL and sqlalchemy.create_engine(c.REPLICA_SQLALCHEMY_URL, pool_size=pool_size,
+                                                                           max_overflow=max_overflow, poolclass=TimedQueuePool) or None
+    replica_check_interval, _replica_checked, _replica_lag = 5, None, None
+
+    # bumped by the _remember_write listener whenever a committed transaction writes to a table
+    table_versions, _table_versions = defaultdict(int), count(1)
 
     @classmethod
     def initialize_db(cls, modify_tables=False, drop=False):
@@ -440,6 +536,142 @@ class Session(SessionManager):
         """
         if modify_tables:
             super(Session, cls).initialize_db(drop=drop)
+            added = cls.add_missing_columns()
+            cls.convert_multichoice_columns()
+            cls.create_missing_indexes()
+            if added & {'attendee.weighted_hours', 'attendee.worked_hours'}:
+                with cls() as session:
+                    log.info('filled in the stored hours of {} staffers', len(session.reconcile_staffer_hours()))
+            if added & {'attendee.name_key', 'attendee.email_key'}:
+                with cls() as session:
+                    log.info('filled in the identity keys of {} attendees', session.backfill_identity_keys())
+
+    @classmethod
+    @contextmanager
+    def read_only(cls):
+        """
+        Returns a session for code which only reads from the database, like our
+        reports.  It never autoflushes and refuses to flush changes, so none of
+        our before_flush hooks ever run, and on Postgres its transactions are
+        read-only.  Unlike our usual sessions, it's never committed, and it may
+        read from our replica; see read_bind() for when it does.
+        """
+        session = cls.session_factory(autoflush=False, bind=cls.read_bind(), info={'read_only': True})
+        try:
+            yield session
+        finally:
+            session.close()
+
+    @classmethod
+    def data_version(cls, *models):
+        """
+        Returns a value which changes whenever this process commits a change to
+        any of the given models' tables, e.g. to tell when a report is stale.
+        """
+        return tuple(cls.table_versions[model.__table__.name] for model in models)
+
+    @classmethod
+    def read_bind(cls):
+        """
+        Returns the engine which read-only sessions should use: our replica if
+        we have one and it's no more than c.REPLICA_MAX_LAG seconds behind, and
+        the current user hasn't saved anything in that long, otherwise the primary.
+        """
+        if not cls.replica_engine or _wrote_recently():
+            return cls.engine
+        lag = cls.replica_lag()
+        return cls.engine if lag is None or lag > c.REPLICA_MAX_LAG else cls.replica_engine
+
+    @classmethod
+    def replica_lag(cls):
+        """
+        Returns how many seconds behind the primary our replica is, or None if
+        we couldn't reach it.  This is checked at most every few seconds.  A
+        replica which has replayed everything it's received counts as current,
+        even if nothing has been written to the primary in a while.
+        """
+        now = monotonic()
+        if cls._replica_checked is None or now - cls._replica_checked > cls.replica_check_interval:
+            cls._replica_checked = now
+            try:
+                with cls.replica_engine.connect() as conn:
+                    if conn.dialect.name != 'postgresql':
+                        cls._replica_lag = 0
+                    else:
+                        version = int(conn.execute("SELECT current_setting('server_version_num')").scalar())
+                        cls._replica_lag = float(conn.execute(cls.replica_lag_query(version)).scalar() or 0)
+            except Exception:
+                log.warning('unable to check how far behind our replica is', exc_info=True)
+                cls._replica_lag = None
+        return cls._replica_lag
+
+    @staticmethod
+    def replica_lag_query(server_version_num):
+        """Postgres 10 renamed the xlog functions we use to check on our replica, and dropped the old names."""
+        receive, replay = ['pg_last_xlog_receive_location', 'pg_last_xlog_replay_location'] if server_version_num < 100000 \
+                     else ['pg_last_wal_receive_lsn', 'pg_last_wal_replay_lsn']
+        return ('SELECT CASE WHEN NOT pg_is_in_recovery() OR {}() = {}() THEN 0 '
+                'ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END').format(receive, replay)
+
+    @classmethod
+    def add_missing_columns(cls):
+        """
+        Creating our tables doesn't add columns which were declared after a table
+        was created, so we add any which the database doesn't have yet, using the
+        same column definition (including its server default) that creating the
+        table would have used.  Returns the added columns as "table.column" names
+        so that initialize_db can fill in any which can't just use their default.
+        """
+        added = set()
+        with cls.engine.begin() as conn:
+            inspector, ddl = sqlalchemy.inspect(conn), conn.dialect.ddl_compiler(conn.dialect, None)
+            for model in cls.all_models():
+                table = model.__table__
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing:
+                        log.info('adding column {}.{}', table.name, column.name)
+                        conn.execute('ALTER TABLE "{}" ADD COLUMN {}'.format(table.name, ddl.get_column_specification(column)))
+                        added.add('{}.{}'.format(table.name, column.name))
+        return added
+
+    @classmethod
+    def convert_multichoice_columns(cls):
+        """
+        MultiChoice columns used to be comma-separated text on Postgres too, so
+        we convert any which still are into the integer arrays we now use.
+        """
+        if cls.engine.dialect.name != 'postgresql':
+            return
+
+        with cls.engine.begin() as conn:
+            text_columns = set(map(tuple, conn.execute("SELECT table_name, column_name FROM information_schema.columns "
+                                                       "WHERE table_schema = current_schema() AND data_type = 'text'")))
+            for model in cls.all_models():
+                for column in model.__table__.columns:
+                    if isinstance(column.type, MultiChoice) and (model.__table__.name, column.name) in text_columns:
+                        log.info('converting {}.{} to an integer array', model.__table__.name, column.name)
+                        conn.execute('ALTER TABLE "{0}" ALTER COLUMN "{1}" DROP DEFAULT, ALTER COLUMN "{1}" TYPE integer[] '
+                                     'USING coalesce(string_to_array(nullif("{1}", \'\'), \',\')::integer[], \'{{}}\')'
+                                     .format(model.__table__.name, column.name))
+
+    @classmethod
+    def create_missing_indexes(cls):
+        """
+        Creating our tables also creates their indexes, but tables which already
+        exist don't get indexes which were declared after they were created, so
+        we look up which indexes the database has by name and add the rest.
+        """
+        with cls.engine.begin() as conn:
+            if cls.engine.dialect.name == 'postgresql':
+                existing = {name for [name] in conn.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")}
+            else:
+                existing = {name for [name] in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            for model in cls.all_models():
+                for index in sorted(model.__table__.indexes, key=lambda index: index.name):
+                    if index.name not in existing:
+                        log.info('creating index {}', index.name)
+                        index.create(conn)
 
     class QuerySubclass(Query):
         @property
@@ -477,6 +709,15 @@ class Session(SessionManager):
         def logged_in_volunteer(self):
             return self.attendee(cherrypy.session['staffer_id'])
 
+        def attendees_by_badge_nums(self, badge_nums):
+            """
+            Returns a dict mapping each of the given badge numbers to the attendee
+            with that number, using a single query; numbers which aren't valid or
+            which nobody has are left out.
+            """
+            nums = {int(num) for num in badge_nums if str(num).strip().isdigit() and int(num)}
+            return {a.badge_num: a for a in self.query(Attendee).filter(Attendee.badge_num.in_(nums))} if nums else {}
+
         def checklist_status(self, slug, department):
             attendee = self.admin_attendee()
             conf = DeptChecklistConf.instances[slug]
@@ -495,11 +736,43 @@ class Session(SessionManager):
                     restricted_hours.add(frozenset(job.hours))
             return [job.to_dict(fields) for job in jobs if job.restricted or frozenset(job.hours) not in restricted_hours]
 
+        def reconcile_staffer_hours(self):
+            """
+            Recalculates the stored weighted_hours and worked_hours for every
+            attendee who has (or used to have) any hours and returns the list of
+            attendees whose stored values had drifted from their actual shifts.
+            """
+            drifted = []
+            for attendee in self.query(Attendee).filter(or_(Attendee.staffing == True,
+                                                            Attendee.nonshift_hours != 0,
+                                                            Attendee.weighted_hours != 0,
+                                                            Attendee.worked_hours != 0)) \
+                                                .options(joinedload(Attendee.shifts).joinedload(Shift.job)).all():
+                before = (attendee.weighted_hours, attendee.worked_hours)
+                attendee.recalculate_hours()
+                if before != (attendee.weighted_hours, attendee.worked_hours):
+                    drifted.append(attendee)
+            return drifted
+
+        def backfill_identity_keys(self):
+            """
+            Fills in the name_key and email_key columns for attendees who were
+            saved before we stored them, and returns how many actually changed.
+            """
+            updated = 0
+            for attendee in self.query(Attendee).filter(or_(Attendee.name_key == '', Attendee.identity_updated == None)):
+                before = (attendee.name_key, attendee.email_key)
+                attendee._identity_keys()
+                updated += before != (attendee.name_key, attendee.email_key)
+            return updated
+
         def get_account_by_email(self, email):
             return self.query(AdminAccount).join(Attendee).filter(func.lower(Attendee.email) == func.lower(email)).one()
 
         def no_email(self, subject):
-            return not self.query(Email).filter_by(subject=subject).all()
+            if subject in Email.sent_subjects:
+                return False
+            return not self.query(self.query(Email.id).filter_by(subject=subject).exists()).scalar()
 
         def season_pass(self, id):
             pss = self.query(PrevSeasonSupporter).filter_by(id=id).all()
@@ -531,9 +804,7 @@ class Session(SessionManager):
             if badge_type not in c.PREASSIGNED_BADGE_TYPES:
                 return 0
 
-            sametype = self.query(Attendee).filter(Attendee.badge_type == badge_type,
-                                                   Attendee.badge_num >= c.BADGE_RANGES[badge_type][0],
-                                                   Attendee.badge_num <= c.BADGE_RANGES[badge_type][1])
+            sametype = self.badges_in_range(badge_type)
             if sametype.count():
                 next = sametype.order_by(Attendee.badge_num.desc()).first().badge_num
                 if old_badge_num and next == old_badge_num:
@@ -550,6 +821,11 @@ class Session(SessionManager):
 
             return next
 
+        def badges_in_range(self, badge_type):
+            """Returns a query for the attendees with the given badge type whose numbers are within its range."""
+            low, high = c.BADGE_RANGES[badge_type]
+            return self.query(Attendee).filter(Attendee.badge_type == badge_type, Attendee.badge_num >= low, Attendee.badge_num <= high)
+
         def shift_badges(self, badge_type, badge_num, *, until=None, **direction):
             # assert_badge_locked()
             until = until or c.MAX_BADGE
@@ -646,21 +922,27 @@ class Session(SessionManager):
                     self.add(attendee)
                     self.commit()
 
-        def everything(self, location=None):
+        def everything_queries(self, location=None):
+            """Returns the queries for the jobs, shifts, and staffers which everything() loads."""
             location_filter = [Job.location == location] if location else []
             jobs = self.query(Job) \
                        .filter(*location_filter) \
                        .options(joinedload(Job.shifts)) \
-                       .order_by(Job.start_time, Job.duration, Job.name).all()
+                       .order_by(Job.start_time, Job.duration, Job.name)
             shifts = self.query(Shift) \
                          .filter(*location_filter) \
                          .options(joinedload(Shift.job), joinedload(Shift.attendee)) \
-                         .join(Shift.job).order_by(Job.start_time).all()
-            attendees = [a for a in self.query(Attendee)
-                                        .filter_by(staffing=True)
-                                        .options(joinedload(Attendee.shifts), joinedload(Attendee.group))
-                                        .order_by(Attendee.full_name).all()
-                         if c.AT_THE_CON or not location or int(location) in a.assigned_depts_ints]
+                         .join(Shift.job).order_by(Job.start_time)
+            attendees = self.query(Attendee) \
+                            .filter_by(staffing=True) \
+                            .options(joinedload(Attendee.shifts), joinedload(Attendee.group)) \
+                            .order_by(Attendee.full_name)
+            return jobs, shifts, attendees
+
+        def everything(self, location=None):
+            jobs, shifts, attendees = self.everything_queries(location)
+            jobs, shifts = jobs.all(), shifts.all()
+            attendees = [a for a in attendees.all() if c.AT_THE_CON or not location or int(location) in a.assigned_depts_ints]
             for job in jobs:
                 job._available_staffers = [a for a in attendees if not job.restricted or a.trusted]
             return jobs, shifts, attendees
@@ -968,7 +1250,7 @@ class Group(MagModel, TakesPaymentMixin):
 
 
 class Attendee(MagModel, TakesPaymentMixin):
-    group_id = Column(UUID, ForeignKey('group.id', ondelete='SET NULL'), nullable=True)
+    group_id = Column(UUID, ForeignKey('group.id', ondelete='SET NULL'), nullable=True, index=True)
     group = relationship(Group, backref='attendees', foreign_keys=group_id, cascade='save-update,merge,refresh-expire,expunge')
 
     placeholder   = Column(Boolean, default=False, admin_only=True)
@@ -995,7 +1277,7 @@ class Attendee(MagModel, TakesPaymentMixin):
     for_review  = Column(UnicodeText, admin_only=True)
     admin_notes = Column(UnicodeText, admin_only=True)
 
-    badge_num  = Column(Integer, default=0, nullable=True, admin_only=True)
+    badge_num  = Column(Integer, default=0, nullable=True, admin_only=True, index=True)
     badge_type = Column(Choice(c.BADGE_OPTS), default=c.ATTENDEE_BADGE, admin_only=True)
     ribbon     = Column(Choice(c.RIBBON_OPTS), default=c.NO_RIBBON, admin_only=True)
 
@@ -1027,6 +1309,15 @@ class Attendee(MagModel, TakesPaymentMixin):
     nonshift_hours   = Column(Integer, default=0, admin_only=True)
     past_years       = Column(UnicodeText, admin_only=True)
 
+    # normalized name and email used to find duplicate registrations, see _identity_keys and find_duplicates
+    name_key         = Column(UnicodeText, admin_only=True, index=True)
+    email_key        = Column(UnicodeText, admin_only=True, index=True)
+    identity_updated = Column(UTCDateTime, nullable=True, admin_only=True, index=True)
+
+    # denormalized from shifts and nonshift_hours by the _update_staffer_hours flush listener
+    weighted_hours = Column(Float, default=0, admin_only=True, index=True)
+    worked_hours   = Column(Float, default=0, admin_only=True, index=True)
+
     no_shirt          = relationship('NoShirt', backref=backref('attendee', load_on_pending=True), uselist=False)
     admin_account     = relationship('AdminAccount', backref=backref('attendee', load_on_pending=True), uselist=False)
     hotel_requests    = relationship('HotelRequests', backref=backref('attendee', load_on_pending=True), uselist=False)
@@ -1044,6 +1335,9 @@ class Attendee(MagModel, TakesPaymentMixin):
 
     _repr_attr_names = ['full_name']
 
+    # the fields displayed by the hotel room assignment tool, see _mark_hotel_changes
+    _hotel_fields = ['first_name', 'last_name', 'badge_type', 'assigned_depts', 'group_id']
+
     @predelete_adjustment
     def _shift_badges(self):
         # _assert_badge_lock()
@@ -1118,6 +1412,13 @@ class Attendee(MagModel, TakesPaymentMixin):
         if self.badge_type == c.STAFF_BADGE:
             self.staffing = True
 
+    @presave_adjustment
+    def _identity_keys(self):
+        name_key, email_key = normalize_name(self.first_name, self.last_name), normalize_email(self.email)
+        if name_key != self.name_key or email_key != self.email_key:
+            self.name_key, self.email_key = name_key, email_key
+            self.identity_updated = datetime.now(UTC)
+
     def unset_volunteering(self):
         self.staffing = self.trusted = False
         self.requested_depts = self.assigned_depts = ''
@@ -1371,15 +1672,30 @@ class Attendee(MagModel, TakesPaymentMixin):
     def worked_shifts(self):
         return [shift for shift in self.shifts if shift.worked == c.SHIFT_WORKED]
 
-    @property
-    def weighted_hours(self):
-        wh = sum((shift.job.weighted_hours for shift in self.shifts), 0.0)
-        return wh + self.nonshift_hours
+    def recalculate_hours(self, shifts=None):
+        """
+        The weighted_hours and worked_hours columns are stored rather than
+        calculated on the fly so that reports can filter on them in SQL.  This
+        recalculates both from the given shifts (defaulting to self.shifts).
+        This is called by a flush listener whenever shifts, jobs, or nonshift
+        hours change, so it should rarely need to be called directly.
+        """
+        shifts = self.shifts if shifts is None else shifts
+        weighted, worked = self.staffer_hours([(shift.job, shift.worked) for shift in shifts], self.nonshift_hours)
+        if self.weighted_hours != weighted:
+            self.weighted_hours = weighted
+        if self.worked_hours != worked:
+            self.worked_hours = worked
 
-    @property
-    def worked_hours(self):
-        wh = sum((shift.job.real_duration * shift.job.weight for shift in self.worked_shifts), 0.0)
-        return wh + self.nonshift_hours
+    @staticmethod
+    def staffer_hours(shifts, nonshift_hours=0):
+        """
+        Returns the (weighted_hours, worked_hours) which a staffer with the given
+        nonshift hours and (job, worked status) pairs for their shifts should have.
+        """
+        weighted = sum((job.weighted_hours for job, worked in shifts), 0.0) + nonshift_hours
+        worked = sum((job.real_duration * job.weight for job, worked in shifts if worked == c.SHIFT_WORKED), 0.0) + nonshift_hours
+        return weighted, worked
 
     def requested(self, department):
         return department in self.requested_depts_ints
@@ -1523,6 +1839,18 @@ class Room(MagModel, NightsMixin):
     created    = Column(UTCDateTime, server_default=utcnow())
     room_assignments = relationship('RoomAssignment', backref='room')
 
+    # bumped by the _bump_hotel_version listener whenever a committed transaction touches
+    # rooms, room assignments, hotel requests, or the attendee fields shown on the hotel pages;
+    # versions are prefixed with a per-process token, since our counter means nothing elsewhere
+    _version_prefix = uuid4().hex[:8]
+    _versions = count(1)
+    version = _version_prefix + '-0'
+
+    @classmethod
+    def bump_version(cls):
+        cls.version = '{}-{}'.format(cls._version_prefix, next(cls._versions))
+        return cls.version
+
 
 class RoomAssignment(MagModel):
     room_id     = Column(UUID, ForeignKey('room.id'))
@@ -1628,8 +1956,8 @@ class Job(MagModel):
 
 
 class Shift(MagModel):
-    job_id      = Column(UUID, ForeignKey('job.id', ondelete='cascade'))
-    attendee_id = Column(UUID, ForeignKey('attendee.id', ondelete='cascade'))
+    job_id      = Column(UUID, ForeignKey('job.id', ondelete='cascade'), index=True)
+    attendee_id = Column(UUID, ForeignKey('attendee.id', ondelete='cascade'), index=True)
     worked      = Column(Choice(c.WORKED_STATUS_OPTS), default=c.SHIFT_UNMARKED)
     rating      = Column(Choice(c.RATING_OPTS), default=c.UNRATED)
     comment     = Column(UnicodeText)
@@ -1716,12 +2044,17 @@ class Email(MagModel):
     fk_id   = Column(UUID, nullable=True)
     model   = Column(UnicodeText)
     when    = Column(UTCDateTime, default=lambda: datetime.now(UTC))
-    subject = Column(UnicodeText)
+    subject = Column(UnicodeText, index=True)
     dest    = Column(UnicodeText)
     body    = Column(UnicodeText)
 
     _repr_attr_names = ['subject']
 
+    # subjects which this process has committed at least one email for, so that Session.no_email can skip its query;
+    # filled in only after commit by _remember_sent_subjects, and anything deleted is dropped again, so the database
+    # remains the source of truth for every subject not in here
+    sent_subjects = set()
+
     @cached_property
     def fk(self):
         try:
@@ -1860,20 +2193,51 @@ class Tracking(MagModel):
 
 Tracking.UNTRACKED = [Tracking, Email]
 
+Attendee.declare_index('ix_attendee_badge_type_num', Attendee.badge_type, Attendee.badge_num)
+Attendee.declare_index('ix_attendee_lower_email', func.lower(Attendee.email))
+Attendee.declare_index('ix_attendee_staffing', Attendee.staffing, where=Attendee.staffing == True)
+Attendee.declare_index('ix_attendee_placeholder', Attendee.placeholder, where=Attendee.placeholder == True)
+Attendee.declare_index('ix_attendee_assigned_depts', Attendee.assigned_depts, using='gin')
+Email.declare_index('ix_email_model_fk_id_subject', Email.model, Email.fk_id, Email.subject)
+Tracking.declare_index('ix_tracking_fk_id_action_when', Tracking.fk_id, Tracking.action, Tracking.when)
+
+
+_bakery = baked.bakery()
+
+
+def _baked_lookup(model, *columns):
+    """
+    Returns a baked query for instances of the model whose given columns equal
+    bound parameters of the same names.  SQLAlchemy caches the Query and its
+    compiled SQL after the first run, so repeating the lookup only costs us
+    binding the new values, e.g. _baked_lookup(Attendee, 'id')(session).params(id=id).one()
+    """
+    query = _bakery(lambda session: session.query(model), model)
+    query.add_criteria(lambda q: q.filter_by(**{column: bindparam(column) for column in columns}), *columns)
+    return query
+
 
 def _make_getter(model):
+    lookups = {}
+
+    def lookup(session, **query):
+        columns = tuple(sorted(query))
+        if columns not in lookups:
+            lookups[columns] = _baked_lookup(model, *columns)
+        return lookups[columns](session).params(**query).one()
+
     def getter(self, params=None, *, bools=(), checkgroups=(), allowed=(), restricted=False, ignore_csrf=False, **query):
         if query:
-            return self.query(model).filter_by(**query).one()
+            return lookup(self, **query)
         elif isinstance(params, str):
-            return self.query(model).filter_by(id=params).one()
+            return lookup(self, id=params)
         else:
             params = params.copy()
             id = params.pop('id', 'None')
             if id == 'None':
                 inst = model()
             else:
-                inst = self.query(model).filter_by(id=id).one()
+                inst = lookup(self, id=id)
 
             if not ignore_csrf:
                 assert not {k for k in params if k not in allowed} or cherrypy.request.method == 'POST', 'POST required'
@@ -1886,6 +2250,94 @@ for _model in Session.all_models():
     setattr(Session.SessionMixin, _model.__tablename__, _make_getter(_model))
 
 
+class Snapshot:
+    """
+    A read-only copy of a row's column values, as kept by ReferenceCache.
+    Columns read as their values, and everything else on the model (e.g.
+    location_label, half_hours, or access_ints) is evaluated against those
+    values, so snapshots can mostly stand in for model instances in our pages.
+    Relationships aren't available, since those would need the database.
+    """
+    def __init__(self, instance):
+        self.__dict__.update(_model=type(instance), _values={col.name: getattr(instance, col.name)
+                                                             for col in instance.__table__.columns})
+
+    def __getattr__(self, name):
+        if name in self._values:
+            return self._values[name]
+
+        for klass in self._model.__mro__:
+            if name in klass.__dict__:
+                attr = klass.__dict__[name]
+                if isinstance(attr, InstrumentedAttribute):
+                    raise AttributeError('{}.{} is not available on cached snapshots'.format(self._model.__name__, name))
+                return attr.__get__(self, self._model) if hasattr(attr, '__get__') else attr
+
+        return self._model.__getattr__(self, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('cached {} snapshots are read-only'.format(self._model.__name__))
+
+    def __eq__(self, other):
+        return isinstance(other, Snapshot) and (self._model, self.id) == (other._model, other.id)
+
+    def __hash__(self):
+        return hash((self._model, self.id))
+
+    def __repr__(self):
+        return '<{} snapshot {}>'.format(self._model.__name__, self.id)
+
+
+class ReferenceCache:
+    """
+    Keeps a Snapshot of every row of the models which rarely change during our
+    event but which are read by most requests, so that looking those up never
+    needs the database.  Each model is loaded in full the first time it's used
+    and reloaded once a transaction writing to its table commits; we compare
+    against Session.data_version(), which our flush listeners maintain, so
+    there's nothing else to invalidate.  Those versions only see commits made
+    by this process, so on multi-node setups entries also expire after
+    c.REFERENCE_CACHE_SECONDS.
+    """
+    models = ['Job', 'Event', 'Room']  # never AdminAccount, since revoked access must take effect immediately
+    lock = RLock()
+    _loaded = {}    # model -> (data version, loaded at, {id: Snapshot})
+    _filtered = {}  # (model, filters) -> (the {id: Snapshot} dict they were filtered from, [Snapshot])
+
+    @classmethod
+    def _snapshots(cls, model):
+        assert model.__name__ in cls.models, '{} is not a cached model'.format(model.__name__)
+        version = Session.data_version(model)  # read this before loading, so a concurrent commit makes what we load stale
+        cached = cls._loaded.get(model)
+        if not cached or cached[0] != version or monotonic() - cached[1] > c.REFERENCE_CACHE_SECONDS:
+            with Session() as session:
+                snapshots = OrderedDict((row.id, Snapshot(row)) for row in session.query(model).order_by(model.id))
+            with cls.lock:
+                cached = cls._loaded[model] = (version, monotonic(), snapshots)
+        return cached
+
+    @classmethod
+    def all(cls, model):
+        return list(cls._snapshots(model)[2].values())
+
+    @classmethod
+    def get(cls, model, id):
+        """Returns the snapshot of the row with the given id, raising a KeyError if there is none."""
+        return cls._snapshots(model)[2][id]
+
+    @classmethod
+    def filter(cls, model, **filters):
+        """Returns the snapshots whose columns have the given values, e.g. ReferenceCache.filter(Job, location=c.CONSOLE)."""
+        version, loaded, snapshots = cls._snapshots(model)
+        key = (model, tuple(sorted(filters.items())))
+        cached = cls._filtered.get(key)
+        if not cached or cached[0] is not snapshots:
+            matches = [s for s in snapshots.values() if all(getattr(s, name) == val for name, val in filters.items())]
+            with cls.lock:
+                cached = cls._filtered[key] = (snapshots, matches)
+        return list(cached[1])
+
+
 def _presave_adjustments(session, context, instances='deprecated'):
     c.BADGE_LOCK.acquire()
     for model in chain(session.dirty, session.new):
@@ -1915,11 +2367,185 @@ def _track_changes(session, context, instances='deprecated'):
                 Tracking.track(action, instance)
 
 
+def _update_staffer_hours(session, context, instances='deprecated'):
+    """
+    Keeps the stored Attendee.weighted_hours and Attendee.worked_hours columns
+    up-to-date whenever a shift is added, removed, or marked as worked, when a
+    job's weight/duration/extra15 changes, or when nonshift_hours is edited.
+    This runs after _track_changes so that these derived values don't clutter
+    up our change history.
+    """
+    deleted = set(session.deleted)
+    attendees = set()
+    for model in chain(session.new, session.dirty, session.deleted):
+        if isinstance(model, Shift):
+            attendees.add(model.attendee or model.attendee_id and session.query(Attendee).get(model.attendee_id))
+        elif isinstance(model, Job) and model not in deleted:
+            if any(get_history(model, attr).has_changes() for attr in ['weight', 'duration', 'extra15']):
+                attendees.update(shift.attendee for shift in model.shifts)
+        elif isinstance(model, Attendee) and model not in deleted:
+            if model.is_new or get_history(model, 'nonshift_hours').has_changes() or get_history(model, 'shifts').has_changes():
+                attendees.add(model)
+
+    pending = [shift for shift in session.new if isinstance(shift, Shift)]
+    for attendee in attendees:
+        if attendee and attendee not in deleted:
+            shifts = [shift for shift in attendee.shifts if shift not in deleted]
+            shifts.extend(shift for shift in pending if shift.attendee_id == attendee.id and shift not in shifts)
+            for shift in shifts:
+                if shift.job is None:
+                    shift.job = session.query(Job).get(shift.job_id)
+            attendee.recalculate_hours(shifts)
+
+
+def _mark_hotel_changes(session, context, instances='deprecated'):
+    """
+    Flags sessions which modify anything shown by the hotel room assignment
+    tool, so that Room.version can be bumped once the transaction commits.
+    """
+    for model in chain(session.new, session.dirty, session.deleted):
+        if isinstance(model, (Room, RoomAssignment, HotelRequests)) \
+                or isinstance(model, Attendee) and (model in session.new or model in session.deleted) and model.assigned_depts \
+                or isinstance(model, Attendee) and any(get_history(model, attr).has_changes() for attr in Attendee._hotel_fields):
+            session.info['hotel_changed'] = True
+            break
+
+
+def _collect_sent_subjects(session, context, instances='deprecated'):
+    subjects = {model.subject for model in session.new if isinstance(model, Email)}
+    if subjects:
+        session.info.setdefault('sent_subjects', set()).update(subjects)
+    deleted = {model.subject for model in session.deleted if isinstance(model, Email)}
+    if deleted:
+        session.info.setdefault('deleted_subjects', set()).update(deleted)
+
+
+def _remember_sent_subjects(session):
+    Email.sent_subjects.difference_update(session.info.pop('deleted_subjects', ()))
+    Email.sent_subjects.update(session.info.pop('sent_subjects', ()))
+
+
+def _forget_sent_subjects(delete_context):
+    """Bulk deletes don't tell us which subjects they removed, so we just start over from the database."""
+    if delete_context.mapper.class_ is Email:
+        Email.sent_subjects.clear()
+
+
+def _bump_hotel_version(session):
+    if session.info.pop('hotel_changed', False):
+        Room.bump_version()
+
+
+def _discard_uncommitted_changes(session):
+    session.info.pop('hotel_changed', None)
+    session.info.pop('sent_subjects', None)
+    session.info.pop('deleted_subjects', None)
+    session.info.pop('written_tables', None)
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    """
+    Stores the start time on the execution context rather than the connection,
+    so that a statement which raises an error can't leave a stale time behind.
+    Statements run by the dialect itself have no context, so we don't time them.
+    """
+    if context is not None:
+        context._query_start_time = monotonic()
+
+
+def _profile_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_start_time', None)
+    if started is None:
+        return
+
+    duration = monotonic() - started
+    IndexAdvisor.record(statement, duration)
+    profile = QueryProfile.current()
+    if profile:
+        profile.record(statement, duration)
+
+
+metrics.gauge('uber_db_pool_size', 'Connections the database pool keeps open.', lambda: Session.engine.pool.size())
+metrics.gauge('uber_db_pool_checked_out', 'Database connections currently in use.', lambda: Session.engine.pool.checkedout())
+metrics.gauge('uber_db_pool_overflow', 'Connections currently open beyond the pool size.', lambda: max(0, Session.engine.pool.overflow()))
+metrics.gauge('uber_db_pool_saturation', 'Fraction of all allowed database connections currently in use.',
+              lambda: Session.engine.pool.checkedout() / (Session.pool_size + Session.max_overflow))
+if Session.replica_engine:
+    metrics.gauge('uber_db_replica_lag_seconds', 'How far behind the primary our database replica is.', lambda: Session.replica_lag() or 0)
+
+
+def _refuse_read_only_flush(session, flush_context, instances):
+    """
+    Flushes of clean sessions return before this hook runs, so this only does
+    anything when read-only code tried to change something.  It's registered
+    first, so that the rest of our before_flush hooks never see read-only sessions.
+    """
+    if session.info.get('read_only'):
+        raise AssertionError('cannot save changes in a read-only session: {}'.format(
+            ', '.join(sorted({type(model).__name__ for model in chain(session.new, session.dirty, session.deleted)}))))
+
+
+def _begin_read_only(session, transaction, connection):
+    if session.info.get('read_only') and connection.dialect.name == 'postgresql':
+        connection.execute('SET TRANSACTION READ ONLY')
+
+
+def _note_write(session, context):
+    session.info.setdefault('written_tables', set()).update(
+        type(model).__table__.name for model in chain(session.new, session.dirty, session.deleted))
+
+
+def _remember_write(session):
+    """
+    Bumps Session.table_versions for the tables this transaction wrote to, and
+    records when the current user last saved something, so that read_bind()
+    keeps them on the primary until our replica has certainly caught up.
+    """
+    written = session.info.pop('written_tables', None)
+    if written:
+        version = next(Session._table_versions)
+        for table in written:
+            Session.table_versions[table] = version
+        cherrypy_session = getattr(cherrypy.serving, 'session', None)
+        if cherrypy_session is not None:
+            cherrypy_session['last_write'] = datetime.now().timestamp()
+
+
+def _wrote_recently():
+    cherrypy_session = getattr(cherrypy.serving, 'session', None)
+    last_write = cherrypy_session and cherrypy_session.get('last_write')
+    return bool(last_write) and datetime.now().timestamp() - last_write <= c.REPLICA_MAX_LAG
+
+
 def register_session_listeners():
+    listen(Session.session_factory, 'before_flush', _refuse_read_only_flush)
+    listen(Session.session_factory, 'after_begin', _begin_read_only)
     listen(Session.session_factory, 'before_flush', _presave_adjustments)
     listen(Session.session_factory, 'before_flush', _track_changes)
+    listen(Session.session_factory, 'before_flush', _update_staffer_hours)
+    listen(Session.session_factory, 'before_flush', _mark_hotel_changes)
+    listen(Session.session_factory, 'before_flush', _collect_sent_subjects)
     listen(Session.session_factory, 'after_flush', _release_badge_lock)
-    listen(Session.engine, 'dbapi_error', _release_badge_lock_on_error)
+    listen(Session.session_factory, 'after_flush', _note_write)
+    listen(Session.session_factory, 'after_commit', _bump_hotel_version)
+    listen(Session.session_factory, 'after_commit', _remember_write)
+    listen(Session.session_factory, 'after_commit', _remember_sent_subjects)
+    listen(Session.session_factory, 'after_bulk_delete', _forget_sent_subjects)
+    listen(Session.session_factory, 'after_rollback', _discard_uncommitted_changes)
+    register_engine_listeners(Session.engine)
+    if Session.replica_engine:
+        register_engine_listeners(Session.replica_engine, replica=True)
+
+
+def register_engine_listeners(engine, replica=False):
+    """
+    Registers the listeners which belong to an engine rather than our session
+    factory, for when Session is pointed at a newly created engine.
+    """
+    if not replica:
+        listen(engine, 'dbapi_error', _release_badge_lock_on_error)
+    listen(engine, 'before_cursor_execute', _start_query_timer)
+    listen(engine, 'after_cursor_execute', _profile_query)
 register_session_listeners()
 
 
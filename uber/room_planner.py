@@ -0,0 +1,126 @@
+"""
+Department heads used to place every staffer into a hotel room by hand.  The RoomPlanner proposes a full set of room
+assignments for a department in one pass, so that heads only need to fix up the edge cases afterwards.
+
+The constraints we enforce are:
+- everyone in a room has requested exactly the nights that room is booked for
+- setup/teardown nights are only used if that part of the request was approved; otherwise we plan around the core
+  nights and decline the rest, which is what happens when a head manually puts someone into a regular room
+- people who mutually requested each other room together whenever their nights match
+- nobody is placed with someone they listed as an unwanted roommate
+- rooms never hold more than c.ROOM_CAPACITY people
+- existing room assignments are never modified, although we do fill empty spots in existing rooms
+"""
+from uber.common import *
+
+
+class _Slot:
+    """A room being filled by the planner, which may or may not already exist in the database."""
+
+    def __init__(self, room, nights, occupants=()):
+        self.room, self.nights = room, nights
+        self.occupants = list(occupants)
+        self.added = []
+
+    @property
+    def size(self):
+        return len(self.occupants) + len(self.added)
+
+
+class RoomPlanner:
+    """
+    Plans room assignments for every attendee in a department who requested
+    hotel space and doesn't yet have a room.  Calling plan() returns the
+    proposed rooms without touching the session, and apply() adds the new
+    Room and RoomAssignment rows to the session so they can be committed.
+    """
+
+    def __init__(self, session, department, capacity=None):
+        self.session, self.department = session, int(department)
+        self.capacity = capacity or c.ROOM_CAPACITY
+        requests = session.query(HotelRequests).filter(HotelRequests.nights != '') \
+                          .options(joinedload(HotelRequests.attendee).joinedload(Attendee.room_assignments)).all()
+        self.matcher = RoommateMatcher(requests)
+        self.requests = {hr.attendee: hr for hr in self.matcher.requests
+                         if hr.attendee.assigned_to(self.department) and not hr.attendee.room_assignments and self.nights_for(hr)}
+        self.rooms = session.query(Room).filter_by(department=self.department) \
+                            .options(joinedload(Room.room_assignments).joinedload(RoomAssignment.attendee)
+                                                                      .joinedload(Attendee.hotel_requests)).order_by(Room.created).all()
+
+        # people already in a room can have listed newcomers as unwanted, so we resolve their requests too
+        occupants = {ra.attendee: ra.attendee.hotel_requests for room in self.rooms for ra in room.room_assignments
+                                                             if ra.attendee.hotel_requests}
+        self.unwanted = defaultdict(set)
+        for attendee, hr in chain(self.requests.items(), occupants.items()):
+            for text, candidates in self.matcher.resolve(hr.unwanted_roommates, exclude=attendee):
+                if len(candidates) == 1:
+                    [other] = candidates
+                    self.unwanted[attendee].add(other)
+                    self.unwanted[other].add(attendee)
+
+    @staticmethod
+    def nights_for(hr):
+        return frozenset(night for night in hr.nights_ints if hr.approved or night in c.CORE_NIGHTS)
+
+    def groups(self):
+        """
+        Returns lists of attendees who should room together: people who asked for
+        each other and want the same nights, split up if there are more of them
+        than fit in one room.  Largest groups come first so they're placed first.
+        """
+        unions = UnionFind(self.requests)
+        for attendee in self.requests:
+            for other in self.matcher.wanted[attendee]:
+                if other in self.requests and attendee in self.matcher.wanted[other] \
+                        and self.nights_for(self.requests[attendee]) == self.nights_for(self.requests[other]):
+                    unions.union(attendee, other)
+
+        groups = []
+        for group in unions.groups():
+            group.sort(key=lambda a: a.full_name)
+            groups.extend(group[i:i + self.capacity] for i in range(0, len(group), self.capacity))
+        return sorted(groups, key=lambda g: (-len(g), g[0].full_name))
+
+    def fits(self, slot, group):
+        return slot.size + len(group) <= self.capacity and not any(
+            other in self.unwanted[attendee] for attendee in group for other in chain(slot.occupants, slot.added))
+
+    def plan(self):
+        """
+        Places each group into the first room with matching nights and enough
+        space (first-fit decreasing), creating a new room when none fits.
+        Returns a list of (room, attendees) tuples for every room which gained
+        at least one attendee.
+        """
+        slots = defaultdict(list)
+        for room in self.rooms:
+            if len(room.room_assignments) < self.capacity:
+                slot = _Slot(room, frozenset(room.nights_ints), [ra.attendee for ra in room.room_assignments])
+                slots[slot.nights].append(slot)
+
+        for group in self.groups():
+            nights = self.nights_for(self.requests[group[0]])
+            for slot in slots[nights]:
+                if self.fits(slot, group):
+                    break
+            else:
+                slot = _Slot(Room(department=self.department, nights=','.join(map(str, sorted(nights)))), nights)
+                slots[nights].append(slot)
+            slot.added.extend(group)
+
+        return [(slot.room, slot.added) for slot in chain.from_iterable(slots.values()) if slot.added]
+
+    def apply(self):
+        """
+        Adds the planned rooms and assignments to the session in a single batch
+        and returns them; the caller is responsible for committing.
+        """
+        planned = self.plan()
+        rooms = [room for room, attendees in planned if room not in self.rooms]
+        assignments = [RoomAssignment(room=room, attendee=attendee) for room, attendees in planned for attendee in attendees]
+        for assignment in assignments:
+            hr = self.requests[assignment.attendee]
+            if not hr.approved and hr.setup_teardown:
+                hr.decline()
+        self.session.add_all(rooms + assignments)
+        return planned
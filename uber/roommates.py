@@ -0,0 +1,146 @@
+"""
+Staffers requesting hotel space can tell us who they want to room with by typing names into a freeform text field,
+e.g. "John Smith, Jane" or "the Smiths and Bob Jones".  This module turns those freeform requests into groups of
+people who should be placed in the same room.
+
+We build a token index over everyone's first, last, and full names, so resolving a roommate request is a handful of
+dictionary lookups rather than a comparison against every other request.  Each resolved request links two people,
+and we merge those links with a union-find structure, so building the groups is effectively linear in the number of
+requests.  Requests which can't be resolved to exactly one person are returned as a list of scored issues so that
+whoever is making room assignments knows which ones need a human to look at them.
+"""
+from uber.common import *
+
+
+class RoommateIssue:
+    """
+    A roommate request which we weren't able to confidently resolve.  The score
+    is between 0 and 1, where lower scores are the ones which most need a human
+    to look at them: 0 means we couldn't find anyone with that name, a fraction
+    means that several people matched equally well, and one-way requests (where
+    we found the person but they didn't ask for the requester) score 0.75.
+    """
+    UNMATCHED, AMBIGUOUS, ONE_WAY = 'unmatched', 'ambiguous', 'one-way'
+
+    def __init__(self, attendee, text, reason, candidates=(), score=0):
+        self.attendee, self.text, self.reason = attendee, text, reason
+        self.candidates = sorted(candidates, key=lambda a: a.full_name)
+        self.score = score
+
+    def __repr__(self):
+        return '<RoommateIssue {} {!r} ({})>'.format(self.attendee.full_name, self.text, self.reason)
+
+    def to_dict(self):
+        return {
+            'id': self.attendee.id,
+            'name': self.attendee.full_name,
+            'text': self.text,
+            'reason': self.reason,
+            'score': self.score,
+            'candidates': [a.full_name for a in self.candidates]
+        }
+
+
+class RoommateMatcher:
+    """
+    Accepts a list of HotelRequests (with their attendees already loaded) and
+    resolves everyone's wanted_roommates text against the names of everyone
+    else in that list.  After construction, the .groups attribute is a list of
+    lists of attendees who should room together (largest groups first) and the
+    .issues attribute is a list of RoommateIssue objects, lowest scores first.
+
+    Attendees in the optional "assigned" collection already have a room, so they
+    can join at most one group; otherwise two groups who each asked for the same
+    assigned person would be merged into one even though neither asked for the other.
+    """
+    _separators = re.compile(r'\s*(?:[,;/&+\n]|\band\b|\bwith\b)\s*', re.IGNORECASE)
+    _junk = re.compile(r"[^a-z' -]")
+    _stopwords = {'the', 'my', 'me', 'and', 'or', 'anyone', 'anybody', 'whoever', 'none', 'na', 'please'}
+
+    def __init__(self, requests, assigned=()):
+        self.requests = [hr for hr in requests if hr.attendee]
+        assigned = set(assigned)
+        self.attendees = [hr.attendee for hr in self.requests]
+        self.full_names, self.first_names, self.last_names = defaultdict(set), defaultdict(set), defaultdict(set)
+        for attendee in self.attendees:
+            first, last = self.normalize(attendee.first_name), self.normalize(attendee.last_name)
+            self.first_names[first].add(attendee)
+            self.last_names[last].add(attendee)
+            self.full_names[first + ' ' + last].add(attendee)
+            for plural in [last + 's', last + 'es']:
+                self.last_names[plural].add(attendee)  # "the Smiths"
+
+        self.wanted = {attendee: set() for attendee in self.attendees}
+        self.issues = []
+        unions = UnionFind(self.attendees)
+        for hr in self.requests:
+            for text, candidates in self.resolve(hr.wanted_roommates, exclude=hr.attendee):
+                if len(candidates) == 1:
+                    self.wanted[hr.attendee].update(candidates)
+                elif candidates:
+                    self.issues.append(RoommateIssue(hr.attendee, text, RoommateIssue.AMBIGUOUS, candidates, score=1 / len(candidates)))
+                else:
+                    self.issues.append(RoommateIssue(hr.attendee, text, RoommateIssue.UNMATCHED))
+
+        links = defaultdict(list)  # assigned attendee -> the unassigned attendees they're linked with
+        for attendee, wanted in self.wanted.items():
+            for other in wanted:
+                if attendee in assigned or other in assigned:
+                    if attendee not in assigned or other not in assigned:
+                        key, linked = (attendee, other) if attendee in assigned else (other, attendee)
+                        links[key].append(linked)
+                else:
+                    unions.union(attendee, other)
+                if attendee not in self.wanted[other]:
+                    self.issues.append(RoommateIssue(attendee, other.full_name, RoommateIssue.ONE_WAY, [other], score=0.75))
+
+        for attendee, linked in links.items():
+            unions.union(attendee, linked[0])  # only ever attached to one group, so never a bridge between two
+
+        self.groups = sorted([sorted(group, key=lambda a: a.full_name) for group in unions.groups()], key=lambda g: (-len(g), g[0].full_name))
+        self.issues.sort(key=lambda issue: (issue.score, issue.attendee.full_name))
+
+    @classmethod
+    def normalize(cls, name):
+        return ' '.join(cls._junk.sub(' ', (name or '').lower()).split())
+
+    def lookup(self, words):
+        """
+        Returns the set of attendees matching a list of normalized words, trying
+        the most specific interpretation first: a full name, then a first name
+        plus a last name, then a bare last name, and finally a bare first name.
+        """
+        if len(words) >= 2:
+            full = self.full_names.get(' '.join(words))
+            if full:
+                return full
+            for i in range(1, len(words)):
+                both = self.first_names.get(' '.join(words[:i]), set()) & self.last_names.get(' '.join(words[i:]), set())
+                if both:
+                    return both
+            for i in range(1, len(words)):
+                last = self.last_names.get(' '.join(words[i:]))
+                if last:
+                    return last
+        elif words:
+            return self.last_names.get(words[0]) or self.first_names.get(words[0]) or set()
+        return set()
+
+    def resolve(self, text, exclude=None):
+        """
+        Splits a freeform roommate request into individual names and yields a
+        (name, candidates) tuple for each, where candidates is the set of
+        attendees who that name could refer to.
+        """
+        for chunk in self._separators.split(text or ''):
+            words = [w for w in self.normalize(chunk).split() if w not in self._stopwords]
+            if words:
+                candidates = self.lookup(words)
+                if candidates != {exclude}:  # people sometimes list themselves along with their roommates
+                    yield chunk.strip(), candidates - {exclude}
+
+    def group_of(self, attendee):
+        for group in self.groups:
+            if attendee in group:
+                return group
+        return [attendee]
@@ -26,3 +26,42 @@ def reset_uber_db():
     assert c.DEV_BOX, 'reset_uber_db is only available on development boxes'
     Session.initialize_db(drop=True, modify_tables=True)
     insert_admin()
+
+
+@entry_point
+def reconcile_staffer_hours():
+    """
+    recalculate the stored weighted_hours and worked_hours columns for all staffers and fix any which have drifted
+    from their actual shifts, e.g. after shifts were edited directly in the database
+    """
+    Session.initialize_db(modify_tables=True)
+    with Session() as session:
+        drifted = session.reconcile_staffer_hours()
+        for attendee in drifted:
+            print('{}: {} weighted hours, {} worked hours'.format(attendee.full_name, attendee.weighted_hours, attendee.worked_hours))
+        print('{} attendees had their stored hours corrected'.format(len(drifted)))
+
+
+@entry_point
+def backfill_identity_keys():
+    """
+    fill in the name_key and email_key columns used by the duplicate registration check for attendees who were saved
+    before we started storing those keys; these attendees are then checked for duplicates on the next run
+    """
+    Session.initialize_db(modify_tables=True)
+    with Session() as session:
+        print('{} attendees had their identity keys filled in'.format(session.backfill_identity_keys()))
+
+
+@entry_point
+def run_worker():
+    """
+    run our background tasks in this process rather than in the web server; any number of these may be started, and
+    only one at a time will actually run tasks (see uber/worker.py)
+    """
+    Session.initialize_db(modify_tables=True)
+    AutomatedEmail.in_worker = True
+    try:
+        Scheduler(background_tasks()).run()
+    except KeyboardInterrupt:
+        stopped.set()
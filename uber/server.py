@@ -65,10 +65,9 @@ mount_site_sections(c.MODULE_ROOT)
 cherrypy.tree.mount(Root(), c.PATH, c.APPCONF)
 static_overrides(join(c.MODULE_ROOT, 'static'))
 
-DaemonTask(check_unassigned, interval=300)
-DaemonTask(detect_duplicates, interval=300)
-DaemonTask(check_placeholders, interval=300)
-DaemonTask(AutomatedEmail.send_all, interval=300)
+if c.RUN_DAEMON_TASKS:
+    for _task in BACKGROUND_TASKS:
+        DaemonTask(metered_task(_task), interval=300)
 
 # TODO: this should be replaced by something a little cleaner, but it can be a useful debugging tool
 # DaemonTask(lambda: log.error(Session.engine.pool.status()), interval=5)
@@ -39,3 +39,39 @@ class Root:
             'last_commit_log': last_commit_log,
             'git_status': git_status
         }
+
+    def query_profiles(self, sort='queries'):
+        with QueryProfile.lock:
+            handlers = [dict(stats) for stats in QueryProfile.stats.values()]
+        for stats in handlers:
+            stats['avg_queries'] = stats['queries'] / stats['calls']
+            stats['avg_db_time'] = stats['db_time'] / stats['calls']
+        sort = sort if sort in ['queries', 'db_time', 'max_queries', 'max_db_time', 'n_plus_one', 'calls'] else 'queries'
+        return {
+            'sort': sort,
+            'handlers': sorted(handlers, key=lambda stats: stats[sort], reverse=True)[:50]
+        }
+
+    def index_advice(self, min_uses=None):
+        min_uses = int(min_uses) if min_uses else c.INDEX_ADVISOR_MIN_USES
+        return {
+            'min_uses': min_uses,
+            'advice': IndexAdvisor.recommendations(min_uses)
+        }
+
+    @unrestricted
+    def metrics(self):
+        """
+        Our metrics in the Prometheus text format, for our own scraper, which
+        must send c.METRICS_TOKEN as a bearer token from one of c.METRICS_IPS;
+        if no token is configured then this page is disabled entirely.
+        """
+        if not c.METRICS_TOKEN:
+            raise cherrypy.HTTPError(404, 'metrics are disabled because no metrics_token is configured')
+        if cherrypy.request.remote.ip not in c.METRICS_IPS:
+            raise cherrypy.HTTPError(403, 'metrics are not available from {}'.format(cherrypy.request.remote.ip))
+        auth = cherrypy.request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth.encode('utf-8'), 'Bearer {}'.format(c.METRICS_TOKEN).encode('utf-8')):
+            raise cherrypy.HTTPError(401, 'a valid metrics bearer token is required')
+        cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+        return metrics.render()
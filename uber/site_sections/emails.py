@@ -1,5 +1,36 @@
 from uber.common import *
 
+# Exact counts for the pending_examples page, which can take a while on a large event, so we compute them in the
+# background and have the page poll for them; maps each subject to a [count, done, started] list.
+_exact_counts = {}
+_exact_counts_lock = RLock()
+
+
+def _exact_count(subject, max_age=timedelta(minutes=5)):
+    """
+    Returns a (count, done) tuple for how many people will receive the given
+    email, starting a background count if we don't have a recent one.  The
+    count is None until it's done, and also if counting failed.
+    """
+    with _exact_counts_lock:
+        count, done, started = _exact_counts.get(subject, (None, False, None))
+        if not started or done and datetime.now(UTC) - started > max_age:
+            count, done = None, False
+            _exact_counts[subject] = [count, done, datetime.now(UTC)]
+            Thread(target=_count_pending, args=[subject], name='pending_count', daemon=True).start()
+        return count, done
+
+
+def _count_pending(subject):
+    email = AutomatedEmail.instances[subject]
+    try:
+        [(count, examples)] = AutomatedEmail.evaluate(email.model, [subject], skip_sent=False, render_limit=0).values()
+    except:
+        log.error('unable to count pending {!r} emails', subject, exc_info=True)
+        count = None
+    with _exact_counts_lock:
+        _exact_counts[subject][:2] = [count, True]
+
 
 @all_renderable(c.PEOPLE)
 class Root:
@@ -22,27 +53,45 @@ class Root:
         }
 
     def pending_examples(self, session, subject):
-        count = 0
-        examples = []
         email = AutomatedEmail.instances[subject]
-        attendees, groups = session.everyone()
-        models = {Attendee: attendees, Group: groups, 'SeasonPass': session.season_passes()}
-        for x in models[email.model]:
-            if email.filter(x):
-                count += 1
-                url = {
-                    Group: '../groups/form?id={}',
-                    Attendee: '../registration/form?id={}'
-                }.get(x.__class__, '').format(x.id)
-                if len(examples) < 10:
-                    examples.append([url, email.render(x)])
+        if email.model in [Attendee, Group]:
+            url = {Group: '../groups/form?id={}', Attendee: '../registration/form?id={}'}[email.model]
+            count, examples, exhausted = 0, [], True
+            for x in email.stream(session):
+                if email.filter(x):
+                    count += 1
+                    examples.append([url.format(x.id), email.render(x)])
+                    if len(examples) == 10:
+                        exhausted = False
+                        break
+
+            if exhausted:
+                upper_bound, count_done = count, True
+            else:
+                upper_bound = email.candidates(session).count()
+                count, count_done = _exact_count(subject)
+        else:
+            count, examples = 0, []
+            for x in session.season_passes():
+                if email.filter(x):
+                    count += 1
+                    if len(examples) < 10:
+                        examples.append(['', email.render(x)])
+            upper_bound, count_done = count, True
 
         return {
             'count': count,
+            'count_done': count_done,
+            'upper_bound': upper_bound,
             'subject': subject,
             'examples': examples
         }
 
+    @ajax_gettable
+    def pending_count(self, subject):
+        count, done = _exact_count(subject)
+        return {'count': count, 'done': done}
+
     @csrf_protected
     def approve(self, session, subject):
         session.add(ApprovedEmail(subject=subject))
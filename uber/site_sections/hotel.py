@@ -7,6 +7,7 @@ def cannot_modify_rooms():
 
 @all_renderable(c.PEOPLE)
 class Root:
+    @read_only
     def index(self, session, department=None):
         attendee = session.admin_attendee()
         department = int(department or c.JOB_LOCATION_OPTS[0][0])
@@ -16,15 +17,16 @@ class Root:
             'checklist': session.checklist_status('hotel_eligible', department),
             'attendees': session.query(Attendee)
                                 .filter_by(badge_type=c.STAFF_BADGE)
-                                .filter(Attendee.assigned_depts.contains(str(department)))
+                                .filter(Attendee.assigned_depts.has_any(department))
                                 .order_by(Attendee.full_name).all()
         }
 
+    @read_only
     def requests(self, session, department=None):
         dept_filter = []
         requests = session.query(HotelRequests).join(HotelRequests.attendee).options(joinedload(HotelRequests.attendee)).order_by(Attendee.full_name).all()
         if department:
-            dept_filter = [Attendee.assigned_depts.contains(department)]
+            dept_filter = [Attendee.assigned_depts.has_any(department)]
             requests = [r for r in requests if r.attendee.assigned_to(department)]
 
         return {
@@ -37,9 +39,10 @@ class Root:
         }
 
     def hours(self, session):
-        staffers = session.query(Attendee).filter_by(badge_type=c.STAFF_BADGE).order_by(Attendee.full_name).all()
-        staffers = [s for s in staffers if s.hotel_shifts_required and s.weighted_hours < 30]
-        return {'staffers': staffers}
+        staffers = session.query(Attendee).filter(Attendee.badge_type == c.STAFF_BADGE, Attendee.weighted_hours < 30) \
+                                          .options(joinedload(Attendee.hotel_requests)) \
+                                          .order_by(Attendee.full_name).all()
+        return {'staffers': [s for s in staffers if s.hotel_shifts_required]}
 
     def no_shows(self, session):
         staffers = session.query(Attendee).filter_by(badge_type=c.STAFF_BADGE).order_by(Attendee.full_name).all()
@@ -58,51 +61,41 @@ class Root:
         session.commit()
         return {'nights': hr.nights_display}
 
+    @report_job(HotelRequests, RoomAssignment, Room, Attendee)
     @csv_file
     def ordered(self, out, session):
         reqs = [hr for hr in session.query(HotelRequests).options(joinedload(HotelRequests.attendee)).all() if hr.nights]
         assigned = {ra.attendee for ra in session.query(RoomAssignment).options(joinedload(RoomAssignment.attendee), joinedload(RoomAssignment.room)).all()}
-        unassigned = {hr.attendee for hr in reqs if hr.attendee not in assigned}
-
-        names = {}
-        for attendee in unassigned:
-            names.setdefault(attendee.last_name.lower(), set()).add(attendee)
-
-        lookup = defaultdict(set)
-        for xs in names.values():
-            for attendee in xs:
-                lookup[attendee] = xs
-
-        for req in reqs:
-            if req.attendee in unassigned:
-                for word in req.wanted_roommates.lower().replace(',', '').split():
-                    try:
-                        combined = lookup[list(names[word])[0]] | lookup[req.attendee]
-                        for attendee in combined:
-                            lookup[attendee] = combined
-                    except:
-                        pass
+        matcher = RoommateMatcher(reqs, assigned)
+        grouped = [[a for a in group if a not in assigned] for group in matcher.groups]
 
         writerow = lambda a, hr: out.writerow([
             a.full_name, a.email, a.cellphone,
             a.hotel_requests.nights_display, ' / '.join(a.assigned_depts_labels),
             hr.wanted_roommates, hr.unwanted_roommates, hr.special_needs
         ])
-        grouped = {frozenset(group) for group in lookup.values()}
         out.writerow(['Name', 'Email', 'Phone', 'Nights', 'Departments', 'Roomate Requests', 'Roomate Anti-Requests', 'Special Needs'])
-        # TODO: for better efficiency, a multi-level joinedload would be preferable here
-        for room in session.query(Room).options(joinedload(Room.room_assignments)).order_by(Room.department).all():
+        for room in session.query(Room).options(*_room_loader()).order_by(Room.department).all():
             for i in range(3):
                 out.writerow([])
             out.writerow([room.department_label + ' room created by department heads for ' + room.nights_display + (' ({})'.format(room.notes) if room.notes else '')])
             for ra in room.room_assignments:
                 writerow(ra.attendee, ra.attendee.hotel_requests)
-        for group in sorted(grouped, key=len, reverse=True):
+        for group in filter(bool, grouped):
             for i in range(3):
                 out.writerow([])
             for a in group:
                 writerow(a, a.hotel_requests)
 
+        issues = [issue for issue in matcher.issues if issue.attendee not in assigned]
+        if issues:
+            for i in range(3):
+                out.writerow([])
+            out.writerow(['Unresolved Roommate Requests'])
+            out.writerow(['Name', 'Request', 'Problem', 'Possible Matches'])
+            for issue in issues:
+                out.writerow([issue.attendee.full_name, issue.text, issue.reason, ' / '.join(a.full_name for a in issue.candidates)])
+
     def assignments(self, session, department):
         if cannot_modify_rooms():
             cherrypy.response.headers['Content-Type'] = 'text/plain'
@@ -150,28 +143,28 @@ class Root:
             }
 
     @ajax
-    def create_room(self, session, **params):
+    def create_room(self, session, version=None, **params):
         params['nights'] = list(filter(bool, [params.pop(night, None) for night in c.NIGHT_NAMES]))
         session.add(session.room(params))
         session.commit()
-        return _hotel_dump(session, params['department'])
+        return _hotel_changes(session, params['department'], version)
 
     @ajax
-    def edit_room(self, session, **params):
+    def edit_room(self, session, version=None, **params):
         params['nights'] = list(filter(bool, [params.pop(night, None) for night in c.NIGHT_NAMES]))
         session.room(params)
         session.commit()
-        return _hotel_dump(session, params['department'])
+        return _hotel_changes(session, params['department'], version)
 
     @ajax
-    def delete_room(self, session, id):
+    def delete_room(self, session, id, version=None):
         room = session.room(id)
         session.delete(room)
         session.commit()
-        return _hotel_dump(session, room.department)
+        return _hotel_changes(session, room.department, version)
 
     @ajax
-    def assign_to_room(self, session, attendee_id, room_id):
+    def assign_to_room(self, session, attendee_id, room_id, version=None):
         room = session.room(room_id)
         for other_room in session.query(RoomAssignment).filter_by(attendee_id=attendee_id).all():
             if set(other_room.nights_ints).intersection(room.nights_ints):
@@ -186,14 +179,21 @@ class Root:
             elif not hr.approved:
                 hr.decline()
             session.commit()
-        return _hotel_dump(session, session.room(room_id).department)
+        return _hotel_changes(session, session.room(room_id).department, version)
 
     @ajax
-    def unassign_from_room(self, session, attendee_id, department):
+    def auto_assign(self, session, department, version=None):
+        assert not cannot_modify_rooms(), 'Hotel rooms are currently locked in'
+        RoomPlanner(session, department).apply()
+        session.commit()
+        return _hotel_changes(session, department, version)
+
+    @ajax
+    def unassign_from_room(self, session, attendee_id, department, version=None):
         for ra in session.query(RoomAssignment).filter_by(attendee_id=attendee_id).all():
             session.delete(ra)
         session.commit()
-        return _hotel_dump(session, department)
+        return _hotel_changes(session, department, version)
 
 
 def _attendee_dict(attendee):
@@ -222,56 +222,130 @@ def _room_dict(session, room):
     })
 
 
-def _get_declined(session, department):
-    return [_attendee_dict(a) for a in session.query(Attendee)
-                                              .order_by(Attendee.full_name)
-                                              .join(Attendee.hotel_requests)
-                                              .filter(Attendee.hotel_requests != None,
-                                                      HotelRequests.nights == '',
-                                                      Attendee.assigned_depts.contains(str(department))).all()]
+def _room_loader():
+    """
+    The eager-load plan shared by everything which loads rooms for display, so
+    that we never lazy-load attendees or their hotel requests one at a time.
+    These are functions rather than constants because the backrefs they use
+    aren't available until our mappers have been configured.
+    """
+    return [joinedload(Room.room_assignments).joinedload(RoomAssignment.attendee).joinedload(Attendee.hotel_requests)]
 
 
-def _get_unconfirmed(session, department, assigned_ids):
-    return [_attendee_dict(a) for a in session.query(Attendee)
-                                              .order_by(Attendee.full_name)
-                                              .filter(Attendee.badge_type == c.STAFF_BADGE,
-                                                      Attendee.hotel_requests == None,
-                                                      Attendee.assigned_depts.contains(str(department))).all()
-                              if a not in assigned_ids]
+def _attendee_loader():
+    return [joinedload(Attendee.hotel_requests), joinedload(Attendee.room_assignments).joinedload(RoomAssignment.room)]
 
 
-def _get_unassigned(session, department, assigned_ids):
-    has_override_access = c.STAFF_ROOMS in AdminAccount.access_set()
-    assigned_to_dept = [] if has_override_access else [Attendee.assigned_depts.like('%{}%'.format(department))]
-    return [_attendee_dict(a) for a in session.query(Attendee)
-                                              .order_by(Attendee.full_name)
-                                              .join(Attendee.hotel_requests)
-                                              .filter(Attendee.hotel_requests != None,
-                                                      HotelRequests.nights != '',
-                                                      *assigned_to_dept).all()
-                              if a.id not in assigned_ids]
+# the most recent dumps for each (department, override access, rooms locked) combination,
+# keyed by the Room.version which was current when they were loaded and stored along with
+# when we loaded them, since commits made by other processes don't bump our Room.version
+_dump_cache = defaultdict(OrderedDict)
+_dump_cache_lock = RLock()
+_dump_cache_size = 5
+_dump_cache_seconds = 30
 
 
-def _get_assigned_elsewhere(session, department):
-    return [_attendee_dict(ra.attendee)
-            for ra in session.query(RoomAssignment)
-                             .options(joinedload(RoomAssignment.attendee), joinedload(RoomAssignment.room))
-                             .join(RoomAssignment.room, RoomAssignment.attendee)
-                             .filter(Room.department != department,
-                                     Attendee.assigned_depts.like('%{}%'.format(department))).all()]
+def _get_roommate_suggestions(requests, unassigned):
+    """
+    Returns the suggested roommate groups and unresolved roommate requests for
+    the unassigned attendees on the assignments page.  Everyone who requested
+    hotel space is indexed, so people can ask for roommates in other departments.
+    """
+    unassigned_ids = {a['id'] for a in unassigned}
+    matcher = RoommateMatcher(requests, [hr.attendee for hr in requests if hr.attendee.room_assignments])
+    groups = [[_attendee_dict(a) for a in group if a.id in unassigned_ids] for group in matcher.groups]
+    return {
+        'roommate_groups': [group for group in groups if len(group) > 1],
+        'roommate_issues': [issue.to_dict() for issue in matcher.issues if issue.attendee.id in unassigned_ids]
+    }
 
 
-def _hotel_dump(session, department):
-    room_filter = {'department': department} if cannot_modify_rooms() or int(department) != c.STOPS else {}
-    rooms = [_room_dict(session, room) for room in session.query(Room).filter_by(**room_filter).order_by(Room.created).all()]
+def _load_hotel_dump(session, department, has_override_access, rooms_locked):
+    """
+    Loads everything shown by the assignments page with two queries: one for the
+    rooms being displayed and one for every attendee who either requested hotel
+    space or is assigned to this department, which we then sort into lists.
+    """
+    room_filter = {'department': department} if rooms_locked or department != c.STOPS else {}
+    rooms = [_room_dict(session, room) for room in session.query(Room).filter_by(**room_filter)
+                                                          .options(*_room_loader()).order_by(Room.created).all()]
+    attendees = session.query(Attendee).outerjoin(Attendee.hotel_requests) \
+                       .filter(or_(HotelRequests.id != None, Attendee.assigned_depts.has_any(department))) \
+                       .options(*_attendee_loader()).order_by(Attendee.full_name).all()
+
     assigned = sum([r['attendees'] for r in rooms], [])
-    assigned_elsewhere = _get_assigned_elsewhere(session, department)
-    assigned_ids = [a['id'] for a in assigned + assigned_elsewhere]
-    return {
+    assigned_elsewhere = [_attendee_dict(a) for a in attendees if a.assigned_to(department) and a.room_assignments
+                                                               and a.room_assignments.room.department != department]
+    assigned_ids = {a['id'] for a in assigned + assigned_elsewhere}
+    requests = [a.hotel_requests for a in attendees if a.hotel_requests]
+    unassigned = [_attendee_dict(hr.attendee) for hr in requests if hr.nights and hr.attendee_id not in assigned_ids
+                                                                 and (has_override_access or hr.attendee.assigned_to(department))]
+    return dict({
         'rooms': rooms,
         'assigned': assigned,
         'assigned_elsewhere': assigned_elsewhere,
-        'declined': _get_declined(session, department),
-        'unconfirmed': _get_unconfirmed(session, department, assigned_ids),
-        'unassigned': _get_unassigned(session, department, assigned_ids)
-    }
+        'declined': [_attendee_dict(hr.attendee) for hr in requests if not hr.nights and hr.attendee.assigned_to(department)],
+        'unconfirmed': [_attendee_dict(a) for a in attendees if a.badge_type == c.STAFF_BADGE and not a.hotel_requests
+                                                             and a.assigned_to(department) and a.id not in assigned_ids],
+        'unassigned': unassigned
+    }, **_get_roommate_suggestions([hr for hr in requests if hr.nights], unassigned))
+
+
+def _dump_key(department):
+    return int(department), c.STAFF_ROOMS in AdminAccount.access_set(), cannot_modify_rooms()
+
+
+def _hotel_dump(session, department):
+    """
+    Returns the assignments page data for a department, loading it at most once
+    per Room.version; the "version" key of the result should be passed back by
+    the client so that subsequent edits can respond with _hotel_changes.
+
+    Cached dumps older than _dump_cache_seconds may be missing changes committed
+    by other processes, so in that case we bump Room.version and load a new dump;
+    the stale one stays cached so clients holding it still get a correct diff.
+    """
+    key = _dump_key(department)
+    version = Room.version  # read this before loading, so a concurrent commit can only make our cache entry unused
+    with _dump_cache_lock:
+        if version in _dump_cache[key]:
+            loaded, dump = _dump_cache[key][version]
+            if monotonic() - loaded < _dump_cache_seconds:
+                return dump
+            elif Room.version == version:
+                Room.bump_version()
+            version = Room.version
+
+    loaded = monotonic()
+    dump = dict(_load_hotel_dump(session, *key), version=version)
+    with _dump_cache_lock:
+        _dump_cache[key][version] = (loaded, dump)
+        while len(_dump_cache[key]) > _dump_cache_size:
+            _dump_cache[key].popitem(last=False)
+    return dump
+
+
+def _hotel_changes(session, department, version=None):
+    """
+    Returns what changed on the assignments page since the client last loaded
+    the dump with the given version: only rooms which were added or modified,
+    the ids of deleted rooms, and whichever attendee lists are different.  If we
+    no longer have that version cached (or it came from another process), we
+    just return the full dump.
+    """
+    dump = _hotel_dump(session, department)
+    with _dump_cache_lock:
+        loaded, previous = _dump_cache[_dump_key(department)].get(str(version), (None, None))
+
+    if not previous:
+        return dump
+
+    old_rooms = {room['id']: room for room in previous['rooms']}
+    changes = {name: xs for name, xs in dump.items() if name != 'rooms' and xs != previous.get(name)}
+    changes.update({
+        'partial': True,
+        'version': dump['version'],
+        'rooms': [room for room in dump['rooms'] if room != old_rooms.get(room['id'])],
+        'deleted_rooms': list(set(old_rooms) - {room['id'] for room in dump['rooms']})
+    })
+    return changes
@@ -22,12 +22,13 @@ def job_dict(job, shifts=None):
         'restricted': job.restricted,
         'timespan': custom_tags.timespan.pretty(job),
         'location_label': job.location_label,
-        'shifts': shifts or [shift_dict(shift) for shift in job.shifts]
+        'shifts': shifts if shifts is not None else [shift_dict(shift) for shift in job.shifts]
     }
 
 
 @all_renderable(c.PEOPLE)
 class Root:
+    @read_only
     def index(self, session, location=None, message=''):
         if location is None:
             if c.AT_THE_CON:
@@ -77,10 +78,9 @@ class Root:
                                           .filter_by(staffing=True)
                                           .order_by(Attendee.full_name).all()],
             'jobs': [job_dict(job, shifts[job.id])
-                     for job in session.query(Job)
-                                       .filter(Job.start_time > localized_now() - timedelta(hours=2))
-                                       .filter_by(**({} if show_restricted else {'restricted': False}))
-                                       .order_by(Job.start_time, Job.location).all()]
+                     for job in sorted(ReferenceCache.filter(Job, **({} if show_restricted else {'restricted': False})),
+                                       key=lambda job: (job.start_time, job.location))
+                     if job.start_time > localized_now() - timedelta(hours=2)]
         }
 
     @ajax
@@ -265,7 +265,7 @@ class Root:
                 (a.id, a.full_name)
                 for a in session.query(Attendee)
                                 .filter(Attendee.email != '',
-                                         ~Attendee.assigned_depts.contains(str(location)))
+                                         ~Attendee.assigned_depts.has_any(location))
                                 .order_by(Attendee.full_name).all()
             ]
         }
@@ -227,7 +227,7 @@ class Root:
         message = check(sale)
         if not message and badge_num is not None:
             try:
-                sale.attendee = session.query(Attendee).filter_by(badge_num=badge_num).one()
+                sale.attendee = session.attendee(badge_num=badge_num)
             except:
                 message = 'No attendee has that badge number'
 
@@ -314,23 +314,22 @@ class Root:
         if csrf_token:
             check_csrf(csrf_token)
             try:
-                picker_upper = session.query(Attendee).filter_by(badge_num=int(picker_upper)).one()
+                picker_upper = session.attendee(badge_num=int(picker_upper))
             except:
                 message = 'Please enter a valid badge number for the person picking up the merch: {} is not in the system'.format(picker_upper)
             else:
+                attendees = session.attendees_by_badge_nums(badges)
                 for badge_num in set(badges):
                     if badge_num:
-                        try:
-                            attendee = session.query(Attendee).filter_by(badge_num=int(badge_num)).one()
-                        except:
+                        attendee = attendees.get(int(badge_num)) if badge_num.strip().isdigit() else None
+                        if not attendee:
                             picked_up.append('{!r} is not a valid badge number'.format(badge_num))
+                        elif attendee.got_merch:
+                            picked_up.append('{a.full_name} (badge {a.badge_num}) already got their merch'.format(a=attendee))
                         else:
-                            if attendee.got_merch:
-                                picked_up.append('{a.full_name} (badge {a.badge_num}) already got their merch'.format(a=attendee))
-                            else:
-                                attendee.got_merch = True
-                                picked_up.append('{a.full_name} (badge {a.badge_num}): {a.merch}'.format(a=attendee))
-                                session.add(MerchPickup(picked_up_by=picker_upper, picked_up_for=attendee))
+                            attendee.got_merch = True
+                            picked_up.append('{a.full_name} (badge {a.badge_num}): {a.merch}'.format(a=attendee))
+                            session.add(MerchPickup(picked_up_by=picker_upper, picked_up_for=attendee))
                 session.commit()
 
         return {
@@ -353,11 +352,11 @@ class Root:
         if not (badge_num.isdigit() and 0 < int(badge_num) < 99999):
             message = 'Invalid badge number'
         else:
-            results = session.query(Attendee).filter_by(badge_num=badge_num)
-            if results.count() != 1:
+            try:
+                attendee = session.attendee(badge_num=badge_num)
+            except:
                 message = 'No attendee has badge number {}'.format(badge_num)
             else:
-                attendee = results.one()
                 if not attendee.merch:
                     message = '{a.full_name} ({a.badge}) has no merch'.format(a=attendee)
                 elif attendee.got_merch:
@@ -847,6 +846,6 @@ class Root:
             'placeholders': [a for a in session.query(Attendee)
                                                .filter(Attendee.placeholder == True,
                                                        Attendee.staffing == True,
-                                                       Attendee.assigned_depts.contains(department))
+                                                       *[Attendee.assigned_depts.has_any(department)] if department else [])
                                                .order_by(Attendee.full_name).all()]
         }
@@ -5,6 +5,7 @@ from uber.common import *
 class Root:
     @unrestricted
     @cached
+    @read_only
     def index(self, session, message=''):
         if c.HIDE_SCHEDULE and not AdminAccount.access_set() and not cherrypy.session.get('staffer_id'):
             return "The " + c.EVENT_NAME + " schedule is being developed and will be made public when it's closer to being finalized."
@@ -82,6 +83,7 @@ class Root:
             'schedule': sorted(schedule.items(), key=lambda tup: c.ORDERED_EVENT_LOCS.index(tup[1][0]['location']))
         })
 
+    @report_job(Event, AssignedPanelist, Attendee)
     @csv_file
     def panels(self, out, session):
         out.writerow(['Panel', 'Time', 'Duration', 'Room', 'Description', 'Panelists'])
@@ -103,18 +105,13 @@ class Root:
 
         current, upcoming = [], []
         for loc, desc in c.EVENT_LOCATION_OPTS:
-            approx = session.query(Event).filter(Event.location == loc,
-                                                 Event.start_time >= now - timedelta(hours=6),
-                                                 Event.start_time <= now).all()
-            for event in approx:
-                if now in event.half_hours:
+            events = ReferenceCache.filter(Event, location=loc)
+            for event in events:
+                if now - timedelta(hours=6) <= event.start_time <= now and now in event.half_hours:
                     current.append(event)
 
-            next = session.query(Event) \
-                          .filter(Event.location == loc,
-                                  Event.start_time >= now + timedelta(minutes=30),
-                                  Event.start_time <= now + timedelta(hours=4)) \
-                                .order_by('start_time').all()
+            next = sorted([event for event in events if now + timedelta(minutes=30) <= event.start_time <= now + timedelta(hours=4)],
+                          key=lambda event: event.start_time)
             if next:
                 upcoming.extend(event for event in next if event.start_time == next[0].start_time)
 
@@ -1,7 +1,7 @@
 from uber.common import *
 
 
-@all_renderable(c.STATS)
+@all_renderable(c.STATS, read_only=True)
 class Root:
     def index(self, session):
         attendees, groups = session.everyone()
@@ -68,8 +68,10 @@ class Root:
     def food_restrictions(self, session):
         all_fr = session.query(FoodRestrictions).all()
         guests = session.query(Attendee).filter_by(badge_type=c.GUEST_BADGE).count()
-        volunteers = len([a for a in session.query(Attendee).filter_by(staffing=True).all()
-                            if a.badge_type == c.STAFF_BADGE or a.weighted_hours or not a.takes_shifts])
+        staffers = session.query(Attendee).filter_by(staffing=True)
+        volunteers = staffers.filter(or_(Attendee.badge_type == c.STAFF_BADGE, Attendee.weighted_hours != 0)).count() \
+                   + len([a for a in staffers.filter(Attendee.badge_type != c.STAFF_BADGE, Attendee.weighted_hours == 0).all()
+                            if not a.takes_shifts])
         return {
             'guests': guests,
             'volunteers': volunteers,
@@ -89,6 +91,7 @@ class Root:
         return {'attendees': [a for a in session.query(Attendee).filter_by(staffing=True).order_by(Attendee.full_name).all()
                                 if 'poorly' in a.past_years]}
 
+    @report_job(Job, Shift, Attendee)
     def staffing_overview(self, session):
         jobs, shifts, attendees = session.everything()
         return {
@@ -103,6 +106,7 @@ class Root:
             } for dept, desc in c.JOB_LOCATION_OPTS]
         }
 
+    @report_job(Attendee)
     @csv_file
     def personalized_badges(self, out, session):
         for a in session.query(Attendee).filter(Attendee.badge_num != 0).order_by('badge_num').all():
@@ -115,10 +119,12 @@ class Root:
         cherrypy.response.headers['Content-Type'] = 'application/xml'
         eligible = {
             a: {attr.lower(): getattr(a.food_restrictions, attr, False) for attr in c.FOOD_RESTRICTION_VARS}
-            for a in session.query(Attendee).order_by(Attendee.full_name).all()
-            if not a.is_unassigned
-                and (a.badge_type in (c.STAFF_BADGE, c.GUEST_BADGE)
-                  or a.ribbon == c.VOLUNTEER_RIBBON and a.weighted_hours >= 12)
+            for a in session.query(Attendee)
+                            .filter(Attendee.first_name != '',
+                                    or_(Attendee.badge_type.in_([c.STAFF_BADGE, c.GUEST_BADGE]),
+                                        and_(Attendee.ribbon == c.VOLUNTEER_RIBBON, Attendee.weighted_hours >= 12)))
+                            .options(joinedload(Attendee.food_restrictions))
+                            .order_by(Attendee.full_name).all()
         }
         return render('summary/food_eligible.xml', {'attendees': eligible})
 
@@ -127,12 +133,15 @@ class Root:
         for a in session.query(Attendee).filter_by(badge_type=c.STAFF_BADGE).order_by('badge_num').all():
             out.writerow([a.badge_num, a.full_name])
 
+    @report_job(Attendee)
     @csv_file
     def all_attendees(self, out, session):
         cols = [getattr(Attendee, col.name) for col in Attendee.__table__.columns]
         out.writerow([col.name for col in cols])
 
-        for attendee in session.query(Attendee).filter(Attendee.first_name != '').order_by(Attendee.badge_num).all():
+        attendees = session.query(Attendee).filter(Attendee.first_name != '').order_by(Attendee.badge_num).all()
+        for i, attendee in enumerate(attendees):
+            report_progress(i, len(attendees))
             row = []
             for col in cols:
                 if isinstance(col.type, Choice):
@@ -13,21 +13,64 @@ angular.module('hotel', ['ngRoute', 'magfest'])
                 unconfirmed: [],
                 assigned_elsewhere: [],
                 declined: [],
+                roommate_groups: [],
+                roommate_issues: [],
                 all_attendees: []
             },
+            _notAttendeeLists: ['rooms', 'roommate_groups', 'roommate_issues', 'all_attendees'],
             _set: function(dst, src) {
                 dst.splice.apply(dst, [0, dst.length].concat(src));
             },
+            version: null,
             set: function(data) {
+                self.version = data.version;
                 angular.forEach(self.lists, function(xs, name) {
                     self._set(xs, data[name] || []);
                 });
+                self._collectAttendees();
+            },
+            update: function(data) {  // mutation endpoints only return the rooms and lists which have changed
+                if (!data.partial) {
+                    return self.set(data);
+                }
+                self.version = data.version;
+                angular.forEach(data.rooms, function (room) {
+                    var index = self._indexOf('rooms', room.id);
+                    if (index === -1) {
+                        self.lists.rooms.push(room);
+                    } else {
+                        self.lists.rooms[index] = room;
+                    }
+                });
+                angular.forEach(data.deleted_rooms, function (id) {
+                    var index = self._indexOf('rooms', id);
+                    if (index !== -1) {
+                        self.lists.rooms.splice(index, 1);
+                    }
+                });
+                angular.forEach(self.lists, function(xs, name) {
+                    if (name != 'rooms' && data[name]) {
+                        self._set(xs, data[name]);
+                    }
+                });
+                self._collectAttendees();
+            },
+            _collectAttendees: function () {
+                self.lists.all_attendees.length = 0;
                 angular.forEach(self.lists, function (xs, name) {
-                    if (name != 'rooms' && name != 'all_attendees') {
+                    if (self._notAttendeeLists.indexOf(name) === -1) {
                         self.lists.all_attendees.push.apply(self.lists.all_attendees, xs);
                     }
                 });
             },
+            _indexOf: function (name, id) {
+                for (var i=0; i < self.lists[name].length; i++) {
+                    if (self.lists[name][i].id === id) {
+                        return i;
+                    }
+                }
+                return -1;
+            },
             get: function (name, id) {
                 for (var i=0, x; x=self.lists[name][i]; i++) {
                     if (x.id === id) {
@@ -59,16 +102,30 @@ angular.module('hotel', ['ngRoute', 'magfest'])
                 url: 'unassign_from_room',
                 params: {
                     attendee_id: attendee_id,
-                    department: $scope.department
+                    department: $scope.department,
+                    version: Hotel.version
                 }
-            }).success(Hotel.set).error(errorHandler);
+            }).success(Hotel.update).error(errorHandler);
+        };
+        $scope.autoAssign = function () {
+            // TODO: replace confirm with an async Angular-driven UI component (for better testability)
+            if (confirm('This will create rooms for everyone in your department who has not yet been assigned to a room.  Existing room assignments will not be changed.')) {
+                $http({
+                    method: 'post',
+                    url: 'auto_assign',
+                    params: {
+                        department: $scope.department,
+                        version: Hotel.version
+                    }
+                }).success(Hotel.update).error(errorHandler);
+            }
         };
         $scope.deleteRoom = function(room_id) {
             $http({
                 method: 'post',
                 url: 'delete_room',
-                params: {id: room_id}
-            }).success(Hotel.set).error(errorHandler);
+                params: {id: room_id, version: Hotel.version}
+            }).success(Hotel.update).error(errorHandler);
         };
     })
     .controller('CreateController', function($scope, $http, $location, magconsts, errorHandler, Hotel) {
@@ -87,9 +144,9 @@ angular.module('hotel', ['ngRoute', 'magfest'])
             $http({
                 method: 'post',
                 url: 'create_room',
-                params: $scope.room
+                params: angular.extend({version: Hotel.version}, $scope.room)
             }).success(function(response) {
-                Hotel.set(response);
+                Hotel.update(response);
                 $location.path('/');
             }).error(errorHandler);
         };
@@ -107,9 +164,9 @@ angular.module('hotel', ['ngRoute', 'magfest'])
             $http({
                 method: 'post',
                 url: 'edit_room',
-                params: $scope.room
+                params: angular.extend({version: Hotel.version}, $scope.room)
             }).success(function(response) {
-                Hotel.set(response);
+                Hotel.update(response);
                 $location.path('/');
             }).error(errorHandler);
         };
@@ -138,8 +195,8 @@ angular.module('hotel', ['ngRoute', 'magfest'])
                 $http({
                     method: 'post',
                     url: 'assign_to_room',
-                    params: $scope.assignment
-                }).success(Hotel.set).error(errorHandler);
+                    params: angular.extend({version: Hotel.version}, $scope.assignment)
+                }).success(Hotel.update).error(errorHandler);
             }
         };
     })
@@ -48,6 +48,7 @@ def init_db(request):
 def db(request, init_db):
     shutil.copy('/tmp/uber.db', '/tmp/uber.db.backup')
     request.addfinalizer(lambda: shutil.move('/tmp/uber.db.backup', '/tmp/uber.db'))
+    request.addfinalizer(Email.sent_subjects.clear)  # restoring the database may un-send emails
 
 
 @pytest.fixture(autouse=True)
@@ -0,0 +1,272 @@
+"""
+Simulates the hour preregistration opens by running many concurrent buyers against a running server, e.g.
+
+    sep prereg_load_test --url http://localhost:8282/magfest --buyers 2000 --concurrency 200 --stripe-latency 0.8
+
+Each buyer polls the stats and check_prereg pages the way the prereg landing page does, fills out the prereg form, and
+pays for their badge.  Payments go to a fake Stripe endpoint which this command runs locally with the given latency, so
+the server under test must have stripe_api_base pointed at it (http://localhost:8383 by default) rather than at Stripe.
+Some fraction of cards are declined so that we exercise the error path as well.
+
+When every buyer is done we report overall throughput, the error rate, and the median and tail latencies of each step,
+and we exit with a nonzero status if the error rate is higher than --max-error-rate.
+"""
+from uber.common import *
+from uber.tests.synthetic import FIRST_NAMES, LAST_NAMES
+
+DECLINED_TOKEN = 'tok_chargeDeclined'
+
+
+def percentile(values, pct):
+    """Returns the nearest-rank percentile (0-100) of a sorted list of numbers."""
+    if not values:
+        return 0
+    return values[max(0, int(math.ceil(len(values) * pct / 100.0)) - 1)]
+
+
+def prereg_params(rand):
+    """Returns the parameters a new attendee would submit on the preregistration form."""
+    first, last = rand.choice(FIRST_NAMES), rand.choice(LAST_NAMES)
+    params = {
+        'badge_type': c.ATTENDEE_BADGE,
+        'first_name': first,
+        'last_name': '{}-{}'.format(last, uuid4().hex[:8]),  # so we're never sent to the duplicate page
+        'email': '{}.{}@example.com'.format(first, uuid4().hex).lower(),
+        'zip_code': '{:05}'.format(rand.randrange(100000)),
+        'ec_phone': '555-{:03}-{:04}'.format(rand.randrange(1000), rand.randrange(10000)),
+        'age_group': rand.choice(c.PREREG_AGE_GROUP_OPTS)[0],
+        'birthdate': '1990-01-01',
+        'amount_extra': 0,
+        'shirt': c.NO_SHIRT,
+        'affiliate': ''
+    }
+    if c.COLLECT_FULL_ADDRESS:
+        params.update(address1='1 Main St', city='Springfield', region='MD', country='United States')
+    return params
+
+
+class FakeStripe(ThreadingMixIn, HTTPServer):
+    """
+    Answers Stripe charge requests locally after sleeping for "latency" seconds
+    plus a random amount of up to "jitter" seconds.  Charges made with
+    DECLINED_TOKEN are declined the way Stripe declines a card.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=8383, latency=0.5, jitter=0.0):
+        self.latency, self.jitter = latency, jitter
+        self.lock = RLock()
+        self.charges = self.declines = 0
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeStripeHandler)
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def start(self):
+        Thread(target=self.serve_forever, name='FakeStripe', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        params = dict(parse_qsl(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')))
+        sleep(self.server.latency + random.uniform(0, self.server.jitter))
+        if self.path != '/v1/charges':
+            self.respond(404, {'error': {'type': 'invalid_request_error', 'message': 'Unrecognized request URL'}})
+        elif params.get('card') == DECLINED_TOKEN:
+            with self.server.lock:
+                self.server.declines += 1
+            self.respond(402, {'error': {'type': 'card_error', 'code': 'card_declined', 'message': 'Your card was declined.'}})
+        else:
+            with self.server.lock:
+                self.server.charges += 1
+            self.respond(200, {
+                'id': 'ch_' + uuid4().hex[:24],
+                'object': 'charge',
+                'paid': True,
+                'livemode': False,
+                'currency': params.get('currency', 'usd'),
+                'amount': int(params.get('amount', 0)),
+                'description': params.get('description', ''),
+                'created': int(mktime(datetime.now().timetuple()))
+            })
+
+    def respond(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass  # thousands of charges would otherwise flood stderr
+
+
+class LoadTestResults:
+    """Collects the duration and outcome of every request our buyers make, keyed by the step which made it."""
+
+    def __init__(self):
+        self.lock = RLock()
+        self.timings = defaultdict(list)  # step -> [seconds]
+        self.errors = defaultdict(Counter)  # step -> {error: count}
+        self.outcomes = Counter()  # buyer outcome -> count
+        self.started = self.finished = None
+
+    def record(self, step, seconds, error=None):
+        with self.lock:
+            self.timings[step].append(seconds)
+            if error:
+                self.errors[step][error] += 1
+
+    def fail(self, step, error):
+        """Records an error for a request which succeeded at the HTTP level but didn't get the page we expected."""
+        with self.lock:
+            self.errors[step][error] += 1
+
+    @property
+    def requests(self):
+        return sum(len(timings) for timings in self.timings.values())
+
+    @property
+    def error_count(self):
+        return sum(sum(errors.values()) for errors in self.errors.values())
+
+    @property
+    def error_rate(self):
+        return self.error_count / self.requests if self.requests else 0
+
+    def report(self):
+        elapsed = (self.finished or monotonic()) - self.started
+        lines = [
+            '{} buyers in {:.1f}s: {}'.format(sum(self.outcomes.values()), elapsed,
+                                               ', '.join('{} {}'.format(n, outcome) for outcome, n in sorted(self.outcomes.items()))),
+            '{:.1f} badges sold/s, {:.1f} requests/s, {:.2%} of requests failed'.format(
+                self.outcomes['paid'] / elapsed, self.requests / elapsed, self.error_rate)
+        ]
+        return '\n'.join(lines + self.latency_table())
+
+    def latency_table(self, label='step'):
+        """Returns the lines of a table of latency percentiles for each step, followed by every error we saw."""
+        width = max([len(label)] + [len(step) for step in self.timings])
+        lines = ['{:<{}} {:>7} {:>7} {:>8} {:>8} {:>8} {:>8}'.format(label, width, 'count', 'errors', 'p50', 'p95', 'p99', 'max')]
+        for step, timings in sorted(self.timings.items()):
+            timings = sorted(timings)
+            lines.append('{:<{}} {:>7} {:>7} {:>7.3f}s {:>7.3f}s {:>7.3f}s {:>7.3f}s'.format(
+                step, width, len(timings), sum(self.errors[step].values()),
+                percentile(timings, 50), percentile(timings, 95), percentile(timings, 99), timings[-1]))
+        for step, errors in sorted(self.errors.items()):
+            for error, n in errors.most_common():
+                lines.append('{} x {} during {}'.format(n, error, step))
+        return lines
+
+
+class Buyer:
+    """One simulated person preregistering, with their own cookies and therefore their own CherryPy session."""
+    payment_id_re = re.compile(r'name="payment_id" value="([0-9a-f]+)"')
+
+    def __init__(self, base_url, results, rand, decline=False, think=0.0, timeout=60):
+        self.base_url, self.results, self.rand = base_url.rstrip('/'), results, rand
+        self.decline, self.think, self.timeout = decline, think, timeout
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+
+    def request(self, step, path, data=None):
+        """Returns the final URL and body of the response, or None if the request failed, which is then recorded as an error."""
+        request = Request(self.base_url + path, data=data and urlencode(data).encode('utf-8'))
+        started, error = monotonic(), None
+        try:
+            with closing(self.opener.open(request, timeout=self.timeout)) as response:
+                return response.geturl(), response.read().decode('utf-8', 'replace')
+        except HTTPError as e:
+            error = 'HTTP {}'.format(e.code)
+        except (URLError, socket.timeout, ConnectionError) as e:
+            error = type(getattr(e, 'reason', e)).__name__
+        finally:
+            self.results.record(step, monotonic() - started, error)
+            sleep(self.rand.uniform(0, self.think))
+
+    def buy(self):
+        """Walks through preregistration and returns the outcome, e.g. paid, declined, or the step which failed."""
+        for step, path in [('stats', '/preregistration/stats'), ('check_prereg', '/preregistration/check_prereg'),
+                           ('form', '/preregistration/form')]:
+            if not self.request(step, path):
+                return 'failed at ' + step
+
+        response = self.request('submit_form', '/preregistration/form', prereg_params(self.rand))
+        if not response:
+            return 'failed at submit_form'
+        url, body = response
+        payment_id = self.payment_id_re.search(body)
+        if not payment_id:
+            self.results.fail('submit_form', 'form not accepted')
+            return 'form not accepted'
+
+        token = DECLINED_TOKEN if self.decline else 'tok_' + uuid4().hex[:24]
+        response = self.request('prereg_payment', '/preregistration/prereg_payment',
+                                {'payment_id': payment_id.group(1), 'stripeToken': token})
+        if not response:
+            return 'failed at prereg_payment'
+        elif 'paid_preregistrations' in response[0]:
+            return 'paid'
+        elif self.decline:
+            return 'declined'
+        else:
+            self.results.fail('prereg_payment', 'payment not accepted')
+            return 'payment not accepted'
+
+
+def run_load_test(base_url, buyers, concurrency, decline_rate=0.02, think=0.0, seed=0):
+    """Runs the given number of buyers, at most "concurrency" at a time, and returns a LoadTestResults."""
+    results, rand = LoadTestResults(), random.Random(seed)
+    plans = [(random.Random(rand.getrandbits(64)), rand.random() < decline_rate) for i in range(buyers)]
+
+    def buy(plan):
+        outcome = Buyer(base_url, results, plan[0], decline=plan[1], think=think).buy()
+        with results.lock:
+            results.outcomes[outcome] += 1
+
+    results.started = monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(buy, plan) for plan in plans]:
+            future.result()
+    results.finished = monotonic()
+    return results
+
+
+@entry_point
+def prereg_load_test():
+    parser = argparse.ArgumentParser(prog='sep prereg_load_test', description='load test the preregistration pages with concurrent buyers')
+    parser.add_argument('--url', default=c.URL_BASE, help='base URL of the server under test')
+    parser.add_argument('--buyers', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50, help='buyers in flight at any one time')
+    parser.add_argument('--think', type=float, default=0.5, help='most seconds a buyer waits between requests')
+    parser.add_argument('--decline-rate', type=float, default=0.02, help='fraction of buyers whose cards are declined')
+    parser.add_argument('--stripe-port', type=int, default=8383, help='port for our fake Stripe endpoint, or 0 to not run one')
+    parser.add_argument('--stripe-latency', type=float, default=0.5, help='seconds our fake Stripe takes per charge')
+    parser.add_argument('--stripe-jitter', type=float, default=0.5, help='most extra random seconds per charge')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(sys.argv[1:])
+
+    stripe_server = None
+    if args.stripe_port:
+        stripe_server = FakeStripe(args.stripe_port, args.stripe_latency, args.stripe_jitter).start()
+        print('fake Stripe listening at {}'.format(stripe_server.url))
+    try:
+        results = run_load_test(args.url, args.buyers, args.concurrency, args.decline_rate, args.think, args.seed)
+    finally:
+        if stripe_server:
+            stripe_server.stop()
+
+    print(results.report())
+    if stripe_server:
+        print('fake Stripe made {} charges and declined {}'.format(stripe_server.charges, stripe_server.declines))
+        if results.outcomes['paid'] and not stripe_server.charges:
+            print('WARNING: nothing was charged through the fake Stripe; is stripe_api_base set for the server under test?')
+    if results.error_rate > args.max_error_rate:
+        sys.exit(1)
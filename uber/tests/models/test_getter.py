@@ -41,3 +41,16 @@ def test_ignore_csrf(request):
         request.addfinalizer(lambda: setattr(cherrypy.request, 'method', 'GET'))
         cherrypy.request.method = 'POST'
         session.attendee({'paid': NEED_NOT_PAY})
+
+def test_repeated_keyword_gets(attendee_id):
+    with Session() as session:
+        for i in range(2):
+            assert session.attendee(first_name='Regular', last_name='Attendee').id == attendee_id
+        pytest.raises(Exception, session.attendee, first_name='Regular', last_name='Nobody')
+
+def test_attendees_by_badge_nums():
+    with Session() as session:
+        badged = session.query(Attendee).filter(Attendee.badge_num != 0).order_by(Attendee.badge_num).limit(2).all()
+        found = session.attendees_by_badge_nums([str(a.badge_num) for a in badged] + ['', 'abc', '0', '99999'])
+        assert found == {a.badge_num: a for a in badged}
+        assert session.attendees_by_badge_nums([]) == {}
@@ -144,3 +144,39 @@ class TestAvailableStaffers:
         monkeypatch.setattr(Job, 'no_overlap', lambda self, a: a in [session.staff_one, session.staff_two])
         assert session.job_one.available_staffers == [session.staff_one]
         assert session.job_four.available_staffers == [session.staff_two]
+
+
+class TestStoredHours:
+    def test_assign_and_unassign(self, session):
+        assert session.staff_one.weighted_hours == 0
+        assert not session.assign(session.staff_one.id, session.job_one.id)
+        assert session.staff_one.weighted_hours == 2.25
+
+        session.delete(session.staff_one.shifts[0])
+        session.commit()
+        assert session.staff_one.weighted_hours == 0
+
+    def test_worked(self, session):
+        assert not session.assign(session.staff_one.id, session.job_two.id)
+        assert session.staff_one.worked_hours == 0
+        session.staff_one.shifts[0].worked = SHIFT_WORKED
+        session.commit()
+        assert session.staff_one.worked_hours == 2
+
+    def test_job_weight_change(self, session):
+        assert not session.assign(session.staff_one.id, session.job_two.id)
+        session.job_two.weight = 2
+        session.commit()
+        assert session.staff_one.weighted_hours == 4
+
+    def test_nonshift_hours(self, session):
+        session.staff_one.nonshift_hours = 3
+        session.commit()
+        assert session.staff_one.weighted_hours == session.staff_one.worked_hours == 3
+
+    def test_reconcile(self, session):
+        assert not session.assign(session.staff_one.id, session.job_two.id)
+        session.execute(Attendee.__table__.update().values(weighted_hours=0))
+        session.expire_all()
+        assert session.reconcile_staffer_hours() == [session.staff_one]
+        assert session.staff_one.weighted_hours == 2
@@ -0,0 +1,36 @@
+from uber.tests import *
+
+
+@pytest.fixture
+def depts():
+    with Session() as session:
+        for first_name, assigned_depts in [('Neither', ''), ('One', '1'), ('Twelve', '12'), ('Both', '12,1'), ('Three', '3,12')]:
+            session.add(Attendee(placeholder=True, first_name=first_name, last_name='Multichoice', assigned_depts=assigned_depts))
+    yield
+    with Session() as session:
+        session.query(Attendee).filter_by(last_name='Multichoice').delete()
+
+
+def _matching(*filters):
+    with Session() as session:
+        return {a.first_name for a in session.query(Attendee).filter(Attendee.last_name == 'Multichoice', *filters)}
+
+
+def test_has_any(depts):
+    assert {'One', 'Both'} == _matching(Attendee.assigned_depts.has_any(1))
+    assert {'Twelve', 'Both', 'Three'} == _matching(Attendee.assigned_depts.has_any('12'))
+    assert {'One', 'Both', 'Three'} == _matching(Attendee.assigned_depts.has_any(1, 3))
+    assert set() == _matching(Attendee.assigned_depts.has_any())
+
+
+def test_has_all(depts):
+    assert {'Both'} == _matching(Attendee.assigned_depts.has_all(1, 12))
+    assert {'Three'} == _matching(Attendee.assigned_depts.has_all(3, 12))
+    assert 5 == len(_matching(Attendee.assigned_depts.has_all()))
+
+
+def test_values_round_trip(depts):
+    with Session() as session:
+        attendee = session.query(Attendee).filter_by(first_name='Both', last_name='Multichoice').one()
+        assert '12,1' == attendee.assigned_depts
+        assert [12, 1] == attendee.assigned_depts_ints
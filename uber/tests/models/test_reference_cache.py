@@ -0,0 +1,35 @@
+from uber.tests import *
+
+
+@pytest.fixture
+def job_id():
+    with Session() as session:
+        job = Job(name='Cached Job', start_time=EPOCH, slots=1, weight=1, duration=2, location=JOB_LOCATION_OPTS[0][0])
+        session.add(job)
+        session.commit()
+        yield job.id
+        session.delete(session.job(job.id))
+
+
+def test_snapshots_act_like_read_only_models(job_id):
+    job = ReferenceCache.get(Job, job_id)
+    assert job.name == 'Cached Job' and job.location_label == JOB_LOCATION_OPTS[0][1]
+    assert job.hours == {EPOCH, EPOCH + timedelta(hours=1)}
+    assert job in ReferenceCache.filter(Job, location=JOB_LOCATION_OPTS[0][0])
+    pytest.raises(AttributeError, setattr, job, 'name', 'Renamed')
+    pytest.raises(AttributeError, getattr, job, 'shifts')
+
+
+def test_cache_hits_skip_the_database(job_id):
+    ReferenceCache.get(Job, job_id)
+    with QueryProfile('cache hit') as profile:
+        ReferenceCache.get(Job, job_id)
+        ReferenceCache.filter(Job, restricted=False)
+    assert profile.queries == 0
+
+
+def test_commits_invalidate_the_cache(job_id):
+    assert ReferenceCache.get(Job, job_id).name == 'Cached Job'
+    with Session() as session:
+        session.job(job_id).name = 'Renamed Job'
+    assert ReferenceCache.get(Job, job_id).name == 'Renamed Job'
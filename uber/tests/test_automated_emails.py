@@ -0,0 +1,31 @@
+from uber.tests import *
+
+def test_eager_load_plan_merges_paths():
+    assert len(eager_load_plan(Attendee, ['shifts', 'shifts.job', 'group', 'group.leader', 'hotel_requests'])) == 3
+    assert eager_load_plan(Attendee, []) == []
+
+def test_eager_load_plan_rejects_unknown_relationships():
+    pytest.raises(KeyError, eager_load_plan, Attendee, ['not_a_relationship'])
+
+def test_eager_loads_include_declared_needs():
+    needs = set.union(*[ae.needs for ae in AutomatedEmail.instances.values() if ae.model is Attendee])
+    assert {'shifts.job', 'hotel_requests'}.issubset(needs)
+    assert AutomatedEmail.eager_loads(Attendee)
+
+def test_criteria_are_merged():
+    volunteer = AutomatedEmail.instances['{} Volunteer Badge Confirmation'.format(c.EVENT_NAME)]
+    shifts = AutomatedEmail.instances['{} shifts available'.format(c.EVENT_NAME)]
+    assert len(volunteer.criteria) == 2 and len(shifts.criteria) == 1
+    assert StopsEmail.criteria == shifts.criteria
+
+def test_sent_subjects_follow_the_database():
+    with Session() as session:
+        assert session.no_email('Sent Subjects Test')
+        session.add(Email(subject='Sent Subjects Test', dest='test@example.com', body='', model='Attendee', fk_id=str(uuid4())))
+        assert 'Sent Subjects Test' not in Email.sent_subjects
+    assert 'Sent Subjects Test' in Email.sent_subjects
+
+    with Session() as session:
+        assert not session.no_email('Sent Subjects Test')
+        session.query(Email).filter_by(subject='Sent Subjects Test').delete(synchronize_session=False)
+        assert session.no_email('Sent Subjects Test')
@@ -0,0 +1,30 @@
+from uber.tests import *
+from uber.tests.synthetic import ConventionGenerator, weighted_choice
+from uber.tests.benchmarks import BENCHMARKS, find_regressions
+
+def test_generator_is_reproducible():
+    first, second = ConventionGenerator(200, seed=7).generate(), ConventionGenerator(200, seed=7).generate()
+    assert len(first.rows[Attendee]) == 200
+    assert [a['id'] for a in first.rows[Attendee]] == [a['id'] for a in second.rows[Attendee]]
+    assert [a['id'] for a in ConventionGenerator(200, seed=8).generate().rows[Attendee]] != [a['id'] for a in first.rows[Attendee]]
+
+def test_generated_rows_are_consistent():
+    generator = ConventionGenerator(200).generate()
+    ids = {a['id'] for a in generator.rows[Attendee]}
+    assert all(shift['attendee_id'] in ids for shift in generator.rows[Shift])
+    assert all(a['name_key'] and a['email_key'] for a in generator.rows[Attendee] if a['first_name'])
+    assert all(leader in ids for group, leader in generator.leaders)
+    assert all(a['weighted_hours'] >= a['worked_hours'] >= a.get('nonshift_hours', 0) for a in generator.rows[Attendee])
+    assert all(a['worked_hours'] == a.get('nonshift_hours', 0) for a in generator.rows[Attendee])  # no shifts are marked worked
+
+def test_weighted_choice():
+    rand = random.Random(0)
+    picks = Counter(weighted_choice(rand, [('a', 9), ('b', 1), ('c', 0)]) for i in range(1000))
+    assert picks['a'] > 800 and 0 < picks['b'] < 200 and not picks['c']
+
+def test_find_regressions(monkeypatch):
+    monkeypatch.setitem(BENCHMARKS, 'fast', {'func': None, 'setup': None, 'threshold': 0.5})
+    monkeypatch.setitem(BENCHMARKS, 'slow', {'func': None, 'setup': None, 'threshold': None})
+    baseline = {'10': {'fast': {'median': 1.0}, 'slow': {'median': 1.0}}}
+    results = {'10': {'fast': {'median': 1.4}, 'slow': {'median': 1.4}}, '20': {'fast': {'median': 9}}}
+    assert find_regressions(results, baseline) == [('10', 'slow', 1.0, 1.4)]
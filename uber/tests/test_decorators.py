@@ -0,0 +1,123 @@
+from uber.tests import *
+
+def test_query_shapes_ignore_parameters():
+    assert QueryProfile.shape('SELECT * FROM attendee WHERE id IN (%(id_1)s, %(id_2)s)\n LIMIT 5') \
+        == QueryProfile.shape('SELECT * FROM attendee WHERE id IN (%(id_1)s) LIMIT 10') \
+        == 'SELECT * FROM attendee WHERE id IN (?) LIMIT ?'
+
+def test_repeated_statements_are_flagged(monkeypatch):
+    monkeypatch.setattr(QueryProfile, 'stats', {})
+    with QueryProfile('outer') as outer:
+        for i in range(N_PLUS_ONE_THRESHOLD):
+            outer.record("SELECT * FROM job WHERE id = '{}'".format(i), 0.001)
+        with QueryProfile('inner') as inner:
+            inner.record('SELECT 1', 0.5)
+    assert outer.queries == N_PLUS_ONE_THRESHOLD + 1
+    assert [n for shape, n in outer.repeated] == [N_PLUS_ONE_THRESHOLD]
+    assert list(QueryProfile.stats) == ['outer'] and QueryProfile.stats['outer']['n_plus_one'] == 1
+
+def test_session_queries_are_profiled():
+    with QueryProfile('session') as profile:
+        with Session() as session:
+            session.query(Attendee).count()
+    assert profile.queries >= 1
+
+def test_index_advisor_parses_filters_joins_and_sorts():
+    statement = 'SELECT shift.id FROM shift JOIN attendee AS attendee_1 ON attendee_1.id = shift.attendee_id ' \
+                'WHERE lower(attendee_1.email) = lower(?) ORDER BY shift.worked DESC LIMIT ?'
+    assert IndexAdvisor.parse(statement) == {('attendee', 'id', 'filter'), ('shift', 'attendee_id', 'filter'),
+                                             ('attendee', 'lower(email)', 'filter'), ('shift', 'worked', 'order')}
+
+def test_index_advisor_skips_indexed_columns(monkeypatch):
+    monkeypatch.setattr(IndexAdvisor, 'usage', {})
+    for i in range(3):
+        IndexAdvisor.record('SELECT * FROM attendee WHERE attendee.first_name = ? AND lower(attendee.email) = lower(?)', 0.1)
+    [advice] = IndexAdvisor.recommendations(min_uses=3)
+    assert advice['key'] == 'first_name' and advice['filter'] == 3
+    assert advice['ddl'] == 'CREATE INDEX ix_attendee_first_name ON "attendee" (first_name);'
+    assert not IndexAdvisor.recommendations(min_uses=4)
+
+def test_read_only_sessions_refuse_changes():
+    with Session.read_only() as session:
+        assert session.query(Attendee).count()
+        session.add(Attendee(placeholder=True, first_name='Read', last_name='Only'))
+        pytest.raises(AssertionError, session.flush)
+        session.rollback()
+
+def test_handlers_can_declare_themselves_read_only(monkeypatch):
+    def handler(self, session): pass
+    assert not is_read_only(handler)
+    assert is_read_only(read_only(handler))
+    monkeypatch.setattr(c, 'READ_ONLY_GETS', True)
+    assert is_read_only(lambda self, session: None) == (cherrypy.request.method == 'GET')
+    assert not is_read_only(read_write(handler))
+
+def test_read_only_sessions_use_a_fresh_replica(monkeypatch):
+    replica = Mock()
+    assert Session.read_bind() is Session.engine
+    monkeypatch.setattr(Session, 'replica_engine', replica)
+    monkeypatch.setattr(Session, 'replica_lag', Mock(return_value=0))
+    assert Session.read_bind() is replica
+    Session.replica_lag.return_value = REPLICA_MAX_LAG + 1
+    assert Session.read_bind() is Session.engine
+    Session.replica_lag.return_value = None
+    assert Session.read_bind() is Session.engine
+
+def test_recent_writers_read_from_the_primary(monkeypatch):
+    monkeypatch.setattr(Session, 'replica_engine', Mock())
+    monkeypatch.setattr(Session, 'replica_lag', Mock(return_value=0))
+    monkeypatch.setattr(cherrypy.serving, 'session', {'last_write': datetime.now().timestamp()}, raising=False)
+    assert Session.read_bind() is Session.engine
+    cherrypy.serving.session['last_write'] -= REPLICA_MAX_LAG + 1
+    assert Session.read_bind() is Session.replica_engine
+
+@pytest.mark.parametrize('server_version_num', [90600, 100005])
+def test_replica_lag_query_runs(monkeypatch, server_version_num):
+    functions = {'pg_last_xact_replay_timestamp'} | ({'pg_last_xlog_receive_location', 'pg_last_xlog_replay_location'}
+                if server_version_num < 100000 else {'pg_last_wal_receive_lsn', 'pg_last_wal_replay_lsn'})
+
+    def execute(sql):
+        if 'server_version_num' in sql:
+            return Mock(scalar=Mock(return_value=str(server_version_num)))
+        for name in re.findall(r'(pg_last_\w+)\(', sql):
+            assert name in functions, 'function {}() does not exist'.format(name)
+        return Mock(scalar=Mock(return_value=0))
+
+    @contextmanager
+    def connect():
+        conn = Mock(execute=execute)
+        conn.dialect.name = 'postgresql'
+        yield conn
+
+    monkeypatch.setattr(Session, 'replica_engine', Mock(connect=connect))
+    monkeypatch.setattr(Session, '_replica_checked', None)
+    assert Session.replica_lag() == 0
+
+def test_report_jobs_are_reused_until_their_data_changes(monkeypatch, tmpdir):
+    monkeypatch.setattr(ReportJob, 'storage_dir', str(tmpdir))
+    monkeypatch.setattr(Session, 'table_versions', defaultdict(int))
+    runs = []
+    def report(self, session):
+        runs.append(session.query(Job).count())
+        return b'report'
+
+    with simulated_request(account_id='admin'):
+        job = ReportJob.start(report, [Job], (None,), {})
+        assert job.finished.wait(5) and job.result() == b'report'
+        assert ReportJob.start(report, [Job], (None,), {}) is job
+        Session.table_versions['job'] += 1
+        rerun = ReportJob.start(report, [Job], (None,), {})
+        assert rerun is not job and rerun.finished.wait(5)
+    assert len(runs) == 2 and job.id not in ReportJob.jobs
+
+def test_report_jobs_expire(monkeypatch, tmpdir):
+    monkeypatch.setattr(ReportJob, 'storage_dir', str(tmpdir))
+    monkeypatch.setattr(c, 'REPORT_MAX_AGE', -1)
+    with simulated_request(account_id='admin'):
+        job = ReportJob.start(lambda self, session: b'report', [Job], (None,), {})
+        assert job.finished.wait(5)
+        rerun = ReportJob.start(job.func, [Job], (None,), {})
+        assert rerun is not job and job.id not in ReportJob.jobs and not exists(job.filename)
+        assert rerun.finished.wait(5)
+        other = ReportJob.start(job.func, [Job], (None,), {'dept': ['1', '2']})
+        assert rerun.id not in ReportJob.jobs and other.key in ReportJob.latest
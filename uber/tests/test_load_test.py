@@ -0,0 +1,34 @@
+from uber.tests import *
+from uber.tests.load_test import DECLINED_TOKEN, FakeStripe, LoadTestResults, percentile
+
+
+@pytest.fixture
+def fake_stripe(request, monkeypatch):
+    server = FakeStripe(port=0, latency=0).start()
+    request.addfinalizer(server.stop)
+    monkeypatch.setattr(stripe, 'api_base', server.url)
+    return server
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([], 50) == 0
+
+def test_error_rate():
+    results = LoadTestResults()
+    results.record('form', 0.1)
+    results.record('form', 0.2, 'HTTP 500')
+    results.fail('form', 'form not accepted')
+    results.record('stats', 0.1)
+    assert results.requests == 3
+    assert results.error_rate == 2 / 3
+
+def test_fake_stripe_charges(fake_stripe):
+    assert Charge(amount=4000, description='Test Badge').charge_cc('tok_visa') is None
+    assert fake_stripe.charges == 1
+
+def test_fake_stripe_declines(fake_stripe):
+    assert 'declined' in Charge(amount=4000, description='Test Badge').charge_cc(DECLINED_TOKEN)
+    assert fake_stripe.declines == 1
@@ -0,0 +1,41 @@
+from uber.tests import *
+
+@pytest.fixture
+def registry():
+    registry = MetricsRegistry()
+    registry.describe('test_seconds', 'histogram', 'Test latencies.')
+    registry.describe('test_total', 'counter', 'Test counts.')
+    return registry
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram([0.1, 1])
+    for value in [0.05, 0.1, 0.5, 5]:
+        histogram.observe(value)
+    assert histogram.cumulative() == [('0.1', 2), ('1.0', 3), ('+Inf', 4)]
+    assert histogram.count == 4 and histogram.sum == 5.65
+
+def test_render(registry):
+    registry.observe('test_seconds', 0.2, handler='a.b')
+    registry.inc('test_total', handler='a.b', outcome='ok')
+    registry.inc('test_total', 2, handler='a.b', outcome='ok')
+    registry.gauge('test_gauge', 'Test gauge.', lambda: 3)
+    text = registry.render()
+    assert '# TYPE test_seconds histogram' in text
+    assert 'test_seconds_bucket{handler="a.b",le="0.25"} 1' in text
+    assert 'test_seconds_count{handler="a.b"} 1' in text
+    assert 'test_total{handler="a.b",outcome="ok"} 3' in text
+    assert 'test_gauge 3.0' in text
+
+def test_labels_are_escaped():
+    assert MetricsRegistry.format_labels([('name', 'a "b"\n')]) == r'{name="a \"b\"\n"}'
+
+def test_undeclared_metrics_are_rejected(registry):
+    pytest.raises(KeyError, registry.inc, 'not_declared')
+    pytest.raises(AssertionError, registry.inc, 'test_seconds')
+
+def test_metered_task_records_failures(monkeypatch, registry):
+    registry.describe('uber_task_seconds', 'histogram', '')
+    registry.describe('uber_task_runs_total', 'counter', '')
+    monkeypatch.setattr(uber.metrics, 'metrics', registry)
+    pytest.raises(ValueError, metered_task(Mock(__qualname__='broken', side_effect=ValueError)))
+    assert registry.values['uber_task_runs_total'] == {(('outcome', 'error'), ('task', 'broken')): 1}
@@ -0,0 +1,33 @@
+from uber.tests import *
+from uber.tests.query_plans import HOT_QUERIES, capture_plan, find_plan_problems
+
+@pytest.fixture
+def session(request):
+    session = Session().session
+    request.addfinalizer(session.close)
+    return session
+
+def plan(cost=10.0, shape=('Index Scan using ix_attendee_badge_num on attendee',), seq_scans=()):
+    return {'cost': cost, 'shape': list(shape), 'seq_scans': list(seq_scans)}
+
+def test_capture_full_scan(session):
+    assert capture_plan(session, session.query(Attendee))['seq_scans'] == ['attendee']
+
+def test_capture_primary_key_lookup(session):
+    assert capture_plan(session, session.query(Attendee).filter_by(id='00000000-0000-0000-0000-000000000000'))['seq_scans'] == []
+
+def test_unexpected_seq_scan():
+    [(is_regression, message)] = find_plan_problems('Session.next_badge_num', [plan(seq_scans=['attendee']), plan()], {}, 0.5)
+    assert is_regression and 'attendee' in message
+    assert not find_plan_problems('Session.everything', [plan(seq_scans=['job'])], {}, 0.5)
+
+def test_cost_regression():
+    baseline = {'Session.no_email': [plan(cost=10.0)]}
+    assert not find_plan_problems('Session.no_email', [plan(cost=14.0)], baseline, 0.5)
+    [(is_regression, message)] = find_plan_problems('Session.no_email', [plan(cost=16.0)], baseline, 0.5)
+    assert is_regression and 'up from 10.0' in message
+
+def test_shape_change_is_not_a_regression():
+    baseline = {'Session.no_email': [plan(shape=['Seq Scan on email'], seq_scans=['email'])]}
+    [(is_regression, message)] = find_plan_problems('Session.no_email', [plan()], baseline, 0.5)
+    assert not is_regression and 'changed its plan' in message
@@ -0,0 +1,27 @@
+from collections import namedtuple
+
+from uber.tests import *
+from uber.tests.replay import form_params, plan_replay
+
+Row = namedtuple('Row', ['when', 'model', 'action', 'who', 'fk_id'])
+
+def test_plan_replay():
+    start = datetime(2016, 1, 2, 12, tzinfo=UTC)
+    rows = [
+        Row(start, 'Attendee', PAGE_VIEWED, 'Test Developer', 'a'),
+        Row(start + timedelta(seconds=30), 'Attendee', UNPAID_PREREG, 'non-admin', 'b'),
+        Row(start + timedelta(seconds=45), 'Attendee', UPDATED, 'Thread-3', 'c'),
+        Row(start + timedelta(seconds=60), 'Group', UPDATED, 'Test Developer', 'd')
+    ]
+    plan, skipped = plan_replay(rows, {'Test Developer'})
+    assert [(offset, spec['endpoint']) for offset, spec, row in plan] == [
+        (0, 'GET registration.form'), (30, 'POST preregistration.form'), (60, 'POST groups.form')]
+    assert skipped == {('Attendee', TRACKINGS[UPDATED], 'task'): 1}
+
+def test_form_params():
+    attendee = Attendee(first_name='Ann', last_name='Lee', staffing=True, international=False,
+                        birthdate=date(1990, 1, 2), registered=datetime(2016, 1, 2, 12, tzinfo=UTC))
+    params = form_params(attendee)
+    assert params['first_name'] == 'Ann' and params['birthdate'] == '1990-01-02'
+    assert params['staffing'] == 1 and 'international' not in params
+    assert params['registered'] == datetime(2016, 1, 2, 12, tzinfo=UTC).astimezone(EVENT_TIMEZONE).strftime(TIMESTAMP_FORMAT)
@@ -0,0 +1,69 @@
+from uber.tests import *
+
+@pytest.fixture
+def dept():
+    return JOB_LOCATION_OPTS[0][0]
+
+@pytest.fixture
+def session(request, dept):
+    session = Session().session
+    request.addfinalizer(session.close)
+
+    def staffer(first, last, nights=CORE_NIGHTS, wanted='', unwanted='', approved=False):
+        attendee = Attendee(first_name=first, last_name=last, badge_type=STAFF_BADGE, paid=NEED_NOT_PAY, assigned_depts=str(dept))
+        attendee.hotel_requests = HotelRequests(nights=','.join(map(str, nights)), wanted_roommates=wanted,
+                                                unwanted_roommates=unwanted, approved=approved)
+        session.add(attendee)
+        return attendee
+
+    session.staffer = staffer
+    return session
+
+def rooms(planned):
+    return sorted(sorted(a.full_name for a in attendees) for room, attendees in planned)
+
+def test_mutual_requests_room_together(session, dept):
+    session.staffer('Ann', 'Lee', wanted='Bob Ray')
+    session.staffer('Bob', 'Ray', wanted='Ann Lee')
+    session.staffer('Cat', 'Cho', nights=CORE_NIGHTS[:1])
+    session.commit()
+    assert rooms(RoomPlanner(session, dept, capacity=2).plan()) == [['Ann Lee', 'Bob Ray'], ['Cat Cho']]
+
+def test_capacity_and_unwanted(session, dept):
+    session.staffer('Ann', 'Lee', unwanted='Bob Ray')
+    session.staffer('Bob', 'Ray')
+    session.staffer('Cat', 'Cho')
+    session.commit()
+    planned = RoomPlanner(session, dept, capacity=2).plan()
+    assert len(planned) == 2
+    assert ['Ann Lee', 'Bob Ray'] not in rooms(planned)
+
+def test_unapproved_setup_is_declined(session, dept):
+    setup_night = [night for night, desc in NIGHT_OPTS if night not in CORE_NIGHTS][0]
+    attendee = session.staffer('Ann', 'Lee', nights=list(CORE_NIGHTS) + [setup_night])
+    session.commit()
+    [(room, attendees)] = RoomPlanner(session, dept).apply()
+    session.commit()
+    assert not room.setup_teardown
+    assert set(attendee.hotel_requests.nights_ints) == set(CORE_NIGHTS)
+
+def test_existing_assignments_are_left_alone(session, dept):
+    ann = session.staffer('Ann', 'Lee')
+    room = Room(department=dept, nights=','.join(map(str, CORE_NIGHTS)))
+    session.add(RoomAssignment(room=room, attendee=ann))
+    session.staffer('Bob', 'Ray')
+    session.commit()
+    planned = RoomPlanner(session, dept).apply()
+    session.commit()
+    assert [r.id for r, attendees in planned] == [room.id]
+    assert sorted(ra.attendee.full_name for ra in room.room_assignments) == ['Ann Lee', 'Bob Ray']
+
+def test_existing_occupants_unwanted_are_respected(session, dept):
+    ann = session.staffer('Ann', 'Lee', unwanted='Bob Ray')
+    room = Room(department=dept, nights=','.join(map(str, CORE_NIGHTS)))
+    session.add(RoomAssignment(room=room, attendee=ann))
+    session.staffer('Bob', 'Ray')
+    session.commit()
+    planned = RoomPlanner(session, dept).plan()
+    assert [r for r, attendees in planned if r is room] == []
+    assert rooms(planned) == [['Bob Ray']]
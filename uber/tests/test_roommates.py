@@ -0,0 +1,64 @@
+from uber.tests import *
+
+def request(first, last, wanted=''):
+    return HotelRequests(attendee=Attendee(first_name=first, last_name=last), wanted_roommates=wanted)
+
+def names(group):
+    return [a.full_name for a in group]
+
+def test_union_find():
+    uf = UnionFind('abcde')
+    uf.union('a', 'b')
+    uf.union('c', 'd')
+    uf.union('b', 'd')
+    assert uf.find('a') == uf.find('c')
+    assert uf.find('e') != uf.find('a')
+    assert sorted(map(sorted, uf.groups())) == [['a', 'b', 'c', 'd'], ['e']]
+
+def test_mutual_full_names():
+    matcher = RoommateMatcher([request('Jane', 'Doe', 'John Smith'), request('John', 'Smith', 'jane doe')])
+    assert names(matcher.groups[0]) == ['Jane Doe', 'John Smith']
+    assert not matcher.issues
+
+def test_transitive_grouping():
+    reqs = [request('A', 'Alpha', 'Bravo'), request('B', 'Bravo', 'Charlie'), request('C', 'Charlie', 'A Alpha'), request('D', 'Delta')]
+    matcher = RoommateMatcher(reqs)
+    assert len(matcher.groups) == 2
+    assert names(matcher.groups[0]) == ['A Alpha', 'B Bravo', 'C Charlie']
+    assert names(matcher.groups[1]) == ['D Delta']
+
+def test_separators_and_punctuation():
+    matcher = RoommateMatcher([request('Ann', 'Lee', 'Bob Ray & the Smiths; Carl'), request('Bob', 'Ray'),
+                               request('Sue', 'Smith'), request('Carl', 'Pike')])
+    assert names(matcher.groups[0]) == ['Ann Lee', 'Bob Ray', 'Carl Pike', 'Sue Smith']
+
+def test_one_way_request():
+    matcher = RoommateMatcher([request('Jane', 'Doe', 'Smith'), request('John', 'Smith')])
+    assert len(matcher.groups) == 1
+    [issue] = matcher.issues
+    assert issue.reason == RoommateIssue.ONE_WAY and issue.score == 0.75
+
+def test_ambiguous_and_unmatched():
+    matcher = RoommateMatcher([request('Jane', 'Doe', 'Smith, Nobody Special'), request('John', 'Smith'), request('Mary', 'Smith')])
+    unmatched, ambiguous = matcher.issues
+    assert unmatched.reason == RoommateIssue.UNMATCHED and unmatched.text == 'Nobody Special' and unmatched.score == 0
+    assert ambiguous.reason == RoommateIssue.AMBIGUOUS and ambiguous.score == 0.5
+    assert names(ambiguous.candidates) == ['John Smith', 'Mary Smith']
+    assert len(matcher.groups) == 3
+
+def test_first_and_last_name_disambiguates():
+    matcher = RoommateMatcher([request('Jane', 'Doe', 'Mary Smith'), request('John', 'Smith'), request('Mary', 'Smith', 'Jane')])
+    assert names(matcher.groups[0]) == ['Jane Doe', 'Mary Smith']
+    assert not matcher.issues
+
+def test_ignores_self_and_filler_words():
+    matcher = RoommateMatcher([request('Jane', 'Doe', 'me, anyone, Jane Doe')])
+    assert names(matcher.groups[0]) == ['Jane Doe']
+    assert not matcher.issues
+
+def test_assigned_attendees_never_bridge_groups():
+    reqs = [request('A', 'Alpha', 'Zed Zulu'), request('B', 'Bravo', 'A Alpha'), request('C', 'Charlie', 'Zed Zulu'), request('Zed', 'Zulu')]
+    zed = reqs[-1].attendee
+    assert len(RoommateMatcher(reqs).groups) == 1
+    matcher = RoommateMatcher(reqs, assigned=[zed])
+    assert sorted(map(names, matcher.groups)) == [['A Alpha', 'B Bravo', 'Zed Zulu'], ['C Charlie']]
@@ -0,0 +1,21 @@
+from uber.tests import *
+
+def test_normalize_name():
+    assert normalize_name('William', 'Smith') == 'william smith'
+    assert normalize_name('Bill', 'Smith') == 'william smith'
+    assert normalize_name(' BOB ', "O'Brien-Jones") == 'robert obrienjones'
+    assert normalize_name('Zorp', '') == 'zorp'
+
+def test_normalize_email():
+    assert normalize_email(' Foo.Bar+mag@GMail.com ') == 'foobar@gmail.com'
+    assert normalize_email('foo.bar@googlemail.com') == 'foobar@gmail.com'
+    assert normalize_email('foo.bar+x@example.com') == 'foo.bar@example.com'
+    assert normalize_email('not an email') == 'not an email'
+
+def test_edit_distance():
+    assert edit_distance('kitten', 'sitting') == 3
+    assert edit_distance('', 'abc') == 3
+    assert edit_distance('same', 'same') == 0
+    assert edit_distance('kitten', 'sitting', limit=1) == 2
+    assert edit_distance('a', 'abcdef', limit=2) == 3
+    assert edit_distance('ab', 'bca', limit=1) == 2
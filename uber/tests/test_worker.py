@@ -0,0 +1,57 @@
+from uber.tests import *
+
+class FakeLock:
+    def __init__(self, leader):
+        self.leader = leader
+
+    def acquire(self):
+        return self.leader
+
+    def release(self):
+        pass
+
+def test_followers_do_not_run_tasks():
+    func = Mock(__qualname__='func')
+    task = ScheduledTask(func, interval=60)
+    Scheduler([task], lock=FakeLock(False)).tick(task.next_run)
+    assert not task.thread
+
+def test_leader_runs_due_tasks():
+    func = Mock(__qualname__='func')
+    task = ScheduledTask(func, interval=60)
+    scheduler = Scheduler([task], lock=FakeLock(True))
+    scheduler.tick(task.next_run - timedelta(seconds=1))
+    assert not task.thread
+    scheduler.tick(task.next_run)
+    task.thread.join()
+    assert func.called and task.runs == 1 and task.last_duration is not None and not task.last_error
+
+def test_skip_if_still_running():
+    release = threading.Event()
+    task = ScheduledTask(Mock(__qualname__='func', side_effect=release.wait), interval=60)
+    task.start(datetime.now(UTC))
+    task.start(datetime.now(UTC))
+    assert task.skipped == 1
+    release.set()
+    task.thread.join()
+    assert task.runs == 1
+
+def test_failures_are_recorded():
+    task = ScheduledTask(Mock(__qualname__='func', side_effect=ValueError), interval=60)
+    task.start(datetime.now(UTC))
+    task.thread.join()
+    assert task.failures == 1 and 'ValueError' in task.last_error
+
+def test_jitter():
+    now = datetime.now(UTC)
+    task = ScheduledTask(Mock(__qualname__='func'), interval=60, jitter=30)
+    task.schedule(now)
+    assert now + timedelta(seconds=60) <= task.next_run <= now + timedelta(seconds=90)
+
+def test_skip_if_running_elsewhere():
+    func = Mock(__qualname__='func')
+    task = ScheduledTask(func, interval=60)
+    task.lock = FakeLock(False)
+    task.start(datetime.now(UTC))
+    task.thread.join()
+    assert not func.called and task.skipped == 1 and task.runs == 0
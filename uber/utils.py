@@ -138,6 +138,27 @@ for _slug, _conf in sorted(c.DEPT_HEAD_CHECKLIST.items(), key=lambda tup: tup[1]
     DeptChecklistConf.register(_slug, _conf)
 
 
+@contextmanager
+def simulated_request(method='GET', path='/', query_string='', **session_data):
+    """
+    Lets us call exposed page handlers outside of a real request, with the given
+    values (e.g. account_id or staffer_id) in the CherryPy session.  Each call
+    gets its own request object, so this is safe to use from several threads.
+    """
+    if not hasattr(cherrypy, 'session'):
+        cherrypy.session = cherrypy._ThreadLocalProxy('session')
+    orig_request, orig_response = cherrypy.serving.request, cherrypy.serving.response
+    request = cherrypy._cprequest.Request(cherrypy.lib.httputil.Host('127.0.0.1', 80), cherrypy.lib.httputil.Host('127.0.0.1', 1111))
+    request.method, request.path_info, request.query_string = method, path, query_string
+    cherrypy.serving.load(request, cherrypy._cprequest.Response())
+    cherrypy.serving.session = session_data
+    try:
+        yield
+    finally:
+        cherrypy.serving.load(orig_request, orig_response)
+        del cherrypy.serving.session
+
+
 def hour_day_format(dt):
     """
     Accepts a localized datetime object and returns a formatted string showing
@@ -251,6 +272,131 @@ class Charge:
             return 'An unexpected problem occured while processing your card: ' + str(e)
 
 
+# Common English nicknames mapped to the name we treat as canonical when looking for people
+# who registered more than once, e.g. so that "Bill Smith" and "William Smith" are compared.
+NICKNAMES = {nick: name for name, nicks in {
+    'alexander': ['alex', 'al', 'xander', 'sasha'],
+    'andrew': ['andy', 'drew'],
+    'anthony': ['tony'],
+    'benjamin': ['ben', 'benji', 'benny'],
+    'catherine': ['cathy', 'cat', 'kate', 'katie', 'katherine', 'kathryn', 'kathy', 'kat'],
+    'charles': ['charlie', 'chuck', 'chas'],
+    'christopher': ['chris', 'topher'],
+    'daniel': ['dan', 'danny'],
+    'david': ['dave', 'davey'],
+    'deborah': ['deb', 'debbie', 'debra'],
+    'edward': ['ed', 'eddie', 'ted', 'ned'],
+    'elizabeth': ['liz', 'lizzie', 'beth', 'betty', 'eliza', 'libby'],
+    'gregory': ['greg'],
+    'james': ['jim', 'jimmy', 'jamie'],
+    'jennifer': ['jen', 'jenny', 'jenn'],
+    'jessica': ['jess', 'jessie'],
+    'john': ['jon', 'johnny', 'jack'],
+    'jonathan': ['jonny', 'jonathon'],
+    'joseph': ['joe', 'joey'],
+    'joshua': ['josh'],
+    'kenneth': ['ken', 'kenny'],
+    'margaret': ['maggie', 'meg', 'peggy'],
+    'matthew': ['matt'],
+    'michael': ['mike', 'mikey', 'mick'],
+    'nicholas': ['nick', 'nicky', 'nicolas'],
+    'patricia': ['pat', 'patty', 'trish'],
+    'patrick': ['paddy'],
+    'rebecca': ['becca', 'becky'],
+    'richard': ['rich', 'rick', 'ricky', 'dick'],
+    'robert': ['rob', 'robbie', 'bob', 'bobby', 'bert'],
+    'samantha': ['sam', 'sammy'],
+    'samuel': ['sammie'],
+    'stephen': ['steve', 'steven', 'stevie'],
+    'susan': ['sue', 'susie', 'suzy'],
+    'thomas': ['tom', 'tommy'],
+    'timothy': ['tim', 'timmy'],
+    'victoria': ['vicky', 'tori'],
+    'william': ['will', 'bill', 'billy', 'willy', 'liam']
+}.items() for nick in nicks}
+
+
+def normalize_name(first_name, last_name):
+    """
+    Returns a lowercase "first last" string with punctuation removed and the
+    first name replaced by its canonical form from our NICKNAMES table.
+    """
+    first, last = [' '.join(re.sub(r'[^a-z ]', '', (name or '').lower()).split()) for name in [first_name, last_name]]
+    return (NICKNAMES.get(first, first) + ' ' + last).strip()
+
+
+def normalize_email(email):
+    """
+    Returns the address a given email address will actually be delivered to,
+    as best we can tell: lowercased, with any "+tag" removed, and with dots
+    removed from Gmail addresses since Gmail ignores them.
+    """
+    email = (email or '').strip().lower()
+    local, at, domain = email.rpartition('@')
+    if not at:
+        return email
+    local = local.split('+')[0]
+    if domain in ['gmail.com', 'googlemail.com']:
+        local, domain = local.replace('.', ''), 'gmail.com'
+    return local + '@' + domain
+
+
+def edit_distance(a, b, limit=None):
+    """
+    Returns the Levenshtein distance between two strings.  If a limit is given,
+    we stop early once the distance must exceed the limit, and any distance
+    above the limit is returned as limit + 1.
+    """
+    if limit is not None and abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1] if limit is None else min(previous[-1], limit + 1)
+
+
+class UnionFind:
+    """Minimal disjoint-set structure with path compression and union by size."""
+
+    def __init__(self, items=()):
+        self.parent, self.size = {}, {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, x, y):
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            if self.size[x] < self.size[y]:
+                x, y = y, x
+            self.parent[y] = x
+            self.size[x] += self.size[y]
+        return x
+
+    def groups(self):
+        grouped = defaultdict(list)
+        for item in self.parent:
+            grouped[self.find(item)].append(item)
+        return list(grouped.values())
+
+
 def get_page(page, queryset):
     return queryset[(int(page) - 1) * 100: int(page) * 100]
 
@@ -0,0 +1,157 @@
+"""
+By default our background tasks run as DaemonTasks inside the web process, but they can instead be run by a separate
+worker process with "sep run_worker", in which case c.RUN_DAEMON_TASKS should be turned off for the web processes.
+
+Any number of workers may be started, e.g. one per app node, but only one of them will run tasks at any given time: the
+worker holding a Postgres advisory lock is the leader, and the others keep trying to acquire that lock so that one of
+them can take over if the leader goes away.  SQLite can't be shared between nodes, so there every worker is the leader.
+
+A leader can lose its lock while one of its tasks is still running, so each run of a task also holds an advisory lock of
+its own for as long as it runs; a new leader skips any task whose previous run (on whichever worker) hasn't finished.
+"""
+from uber.common import *
+
+
+BACKGROUND_TASKS = [check_unassigned, detect_duplicates, check_placeholders, AutomatedEmail.send_all]
+
+
+class ScheduledTask:
+    """
+    A function which the Scheduler runs every "interval" seconds, plus a random
+    delay of up to "jitter" seconds so that tasks with the same interval don't
+    all hit the database at once.  Each run happens in its own thread, and if the
+    previous run is still going when the next one is due, that run is skipped,
+    including when the previous run belongs to a worker which was the leader.
+    """
+
+    def __init__(self, func, interval, jitter=0):
+        self.interval, self.jitter = interval, jitter
+        self.name = getattr(func, '__qualname__', func.__name__)
+        self.func = metered_task(func)
+        self.lock = LeaderLock(lock_id=binascii.crc32('uber.worker.{}'.format(self.name).encode('utf-8')))
+        self.thread = None
+        self.runs = self.failures = self.skipped = 0
+        self.last_started = self.last_duration = self.last_error = None
+        self.schedule(datetime.now(UTC))
+
+    def __repr__(self):
+        return '<ScheduledTask {} every {}s>'.format(self.name, self.interval)
+
+    def schedule(self, after):
+        self.next_run = after + timedelta(seconds=self.interval + random.uniform(0, self.jitter))
+
+    @property
+    def running(self):
+        return bool(self.thread and self.thread.is_alive())
+
+    def start(self, now):
+        self.schedule(now)
+        if self.running:
+            self.skipped += 1
+            log.warning('skipping {} because the run which started at {} is still going', self.name, self.last_started)
+        else:
+            self.thread = Thread(target=self._run, name=self.name, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        if not self.lock.acquire():
+            self.skipped += 1
+            log.warning('skipping {} because another worker is still running it', self.name)
+            return
+
+        self.last_started = datetime.now(UTC)
+        try:
+            self.func()
+        except:
+            self.failures += 1
+            self.last_error = traceback.format_exc()
+            log.error('background task {} failed', self.name, exc_info=True)
+        else:
+            self.last_error = None
+        finally:
+            self.runs += 1
+            self.last_duration = (datetime.now(UTC) - self.last_started).total_seconds()
+            log.info('background task {} {} after {:.2f} seconds', self.name, 'failed' if self.last_error else 'succeeded', self.last_duration)
+            self.lock.release()
+
+
+class LeaderLock:
+    """
+    Holds a session-level Postgres advisory lock on a dedicated connection;
+    whichever worker holds the lock is the leader.  If that connection dies then
+    Postgres releases the lock, so we check the connection every time we're asked
+    whether we're still the leader.  ScheduledTasks also use these, with their
+    own lock ids, to make sure that only one run of each task happens at a time.
+    """
+    lock_id = binascii.crc32(b'uber.worker')
+
+    def __init__(self, engine=None, lock_id=None):
+        self._engine, self.lock_id = engine, lock_id or self.lock_id
+        self.conn = None
+
+    @property
+    def engine(self):
+        return self._engine or Session.engine
+
+    def acquire(self):
+        """Returns whether we are the leader, trying to become the leader if we aren't already."""
+        if self.engine.dialect.name != 'postgresql':
+            return True
+
+        try:
+            if self.conn:
+                self.conn.execute(sqlalchemy.select([1]))
+            else:
+                self.conn = self.engine.connect()
+                if not self.conn.execute(sqlalchemy.select([func.pg_try_advisory_lock(self.lock_id)])).scalar():
+                    self.release()
+        except:
+            log.warning('lost our database connection while checking for the worker leader lock', exc_info=True)
+            self.release()
+        return self.conn is not None
+
+    def release(self):
+        if self.conn:
+            try:
+                self.conn.close()
+            except:
+                log.warning('unable to cleanly close our worker leader lock connection', exc_info=True)
+            self.conn = None
+
+
+class Scheduler:
+    """
+    Runs each of a list of ScheduledTasks whenever it's due, but only while we
+    hold the leader lock.  Call run() to loop until we're stopped.
+    """
+
+    def __init__(self, tasks, lock=None, poll_interval=5):
+        self.tasks, self.poll_interval = tasks, poll_interval
+        self.lock = lock or LeaderLock()
+        self.leader = False
+
+    def tick(self, now=None):
+        now = now or datetime.now(UTC)
+        was_leader, self.leader = self.leader, self.lock.acquire()
+        if self.leader != was_leader:
+            log.info('this worker is {} the leader', 'now' if self.leader else 'no longer')
+            running = [task.name for task in self.tasks if task.running]
+            if not self.leader and running:
+                log.warning('{} will keep running until they finish, and the new leader will skip them until then', running)
+        if self.leader:
+            for task in self.tasks:
+                if task.next_run <= now:
+                    task.start(now)
+
+    def run(self):
+        log.info('starting background worker with tasks {}', self.tasks)
+        try:
+            while not stopped.is_set():
+                self.tick()
+                stopped.wait(self.poll_interval)
+        finally:
+            self.lock.release()
+
+
+def background_tasks():
+    return [ScheduledTask(func, interval=300, jitter=c.WORKER_JITTER) for func in BACKGROUND_TASKS]